@@ -21,13 +21,18 @@ class PassbookApp(AppConfig):
 
     def ready(self):
         from . import signals  # NOQA
+        from .assets import load_default_assets
+
+        load_default_assets()
 
     @cached_property
     def compatibility_errors(self):
         import shutil
 
+        from .signing import get_signer
+
         errs = []
-        if not shutil.which("openssl"):
+        if get_signer().requires_openssl and not shutil.which("openssl"):
             errs.append("The OpenSSL binary is not installed or not in the PATH.")
         return errs
 
@@ -40,4 +45,16 @@ class PassbookApp(AppConfig):
             errs.append(
                 "Pillow is not installed on this system, which is required for converting and scaling images."
             )
+
+        from .push import APNsPushSender, get_push_sender
+
+        if isinstance(get_push_sender(), APNsPushSender):
+            try:
+                import h2  # NOQA
+                import httpx  # NOQA
+            except ImportError:
+                errs.append(
+                    "httpx with HTTP/2 support is not installed on this system, which is required for sending "
+                    "pass updates to devices."
+                )
         return errs
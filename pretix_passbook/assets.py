@@ -0,0 +1,156 @@
+from typing import Iterable, List, Tuple
+
+import asyncio
+import hashlib
+import threading
+import time
+from asgiref.sync import sync_to_async
+from collections import OrderedDict, namedtuple
+from django.conf import settings as django_settings
+from django.contrib.staticfiles import finders
+from django.core.files.storage import default_storage
+from io import BytesIO
+
+from pretix_passbook.metrics import count
+
+DEFAULT_ASSETS = {}
+
+
+class Asset(namedtuple("Asset", ("data", "digest"))):
+    """
+    The content of a file included in a pass together with the SHA-1 digest used in the
+    pass manifest.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Asset":
+        return cls(data, hashlib.sha1(data).hexdigest())
+
+    def open(self) -> BytesIO:
+        return BytesIO(self.data)
+
+
+class AssetCache:
+    """
+    A least-recently-used cache of assets that is bounded by the total size of the cached
+    content rather than by the number of entries. Missing files are cached for
+    ``MISSING_TIMEOUT`` seconds, so they do not cause a storage request for every pass, but
+    files added later are still found.
+    """
+
+    ENTRY_OVERHEAD = 256
+    MISSING_TIMEOUT = 60
+
+    def __init__(self, max_size: int, name: str = "assets"):
+        self.max_size = max_size
+        self.name = name
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_size(self, asset):
+        return self.ENTRY_OVERHEAD + (len(asset.data) if asset is not None else 0)
+
+    def get(self, key, loader) -> Asset:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                count(self.name, "hit")
+                return entry[0]
+
+        count(self.name, "miss")
+        asset = loader()
+        size = self._entry_size(asset)
+        if size > self.max_size:
+            return asset
+
+        with self._lock:
+            self._pop(key)
+            expires = time.monotonic() + self.MISSING_TIMEOUT if asset is None else None
+            self._entries[key] = (asset, expires)
+            self.size += size
+            while self.size > self.max_size:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= self._entry_size(evicted)
+        return asset
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= self._entry_size(entry[0])
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+asset_cache = AssetCache(
+    django_settings.CONFIG_FILE.getint("passbook", "asset_cache_size", fallback=64)
+    * 1024
+    * 1024
+)
+
+
+def _load_storage_asset(name: str):
+    try:
+        with default_storage.open(name, "rb") as f:
+            return Asset.from_bytes(f.read())
+    except OSError:
+        return None
+
+
+def get_storage_asset(name: str, key: str = None):
+    """
+    Returns the asset stored under ``name`` in the default storage, or ``None`` if it does not
+    exist. ``key`` is the setting or property the name was taken from.
+    """
+    return asset_cache.get((key, name), lambda: _load_storage_asset(name))
+
+
+def forget_storage_asset(name: str, key: str = None):
+    """
+    Makes the next ``get_storage_asset`` call for ``name`` and ``key`` in this process read the
+    storage again, e.g. after the file has been created.
+    """
+    asset_cache.discard((key, name))
+
+
+async def aload_assets(names: Iterable[Tuple[str, str]]) -> List[Asset]:
+    """
+    Loads the assets with the given ``(name, key)`` pairs into the cache concurrently and returns
+    them, like ``get_storage_asset`` would.
+    """
+    load = sync_to_async(get_storage_asset, thread_sensitive=False)
+    return await asyncio.gather(*(load(name, key) for name, key in names))
+
+
+def get_setting_asset(settings, key: str):
+    """
+    Returns the asset referenced by a file setting without opening the file through the
+    settings layer, or ``None`` if the setting is empty or the file is missing.
+    """
+    value = settings.get(key, as_type=str)
+    if not value or not value.startswith("file://"):
+        return None
+    return get_storage_asset(value[7:], key)
+
+
+def derived_asset_name(digest: str, scale: int) -> str:
+    """
+    Storage name of the retina variant of an uploaded image with the given digest.
+    """
+    return "passbook/derived/{}@{}x.png".format(digest, scale)
+
+
+def load_default_assets():
+    for name in ("icon.png", "logo.png"):
+        with open(finders.find("pretix_passbook/" + name), "rb") as f:
+            DEFAULT_ASSETS[name] = Asset.from_bytes(f.read())
@@ -0,0 +1,70 @@
+from typing import Callable, Iterator, List, Tuple
+
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.db.models import Q
+from pretix.base.models import Event, Order, OrderPosition
+
+from pretix_passbook.workers import generate_chunk, init_worker
+
+
+def get_positions(event: Event, subevent=None, items=None, include_pending=False):
+    """
+    Returns the positions of an event that a bulk export should include passes for.
+    """
+    qs = OrderPosition.objects.filter(order__event=event)
+    if include_pending:
+        qs = qs.filter(order__status__in=[Order.STATUS_PAID, Order.STATUS_PENDING])
+    else:
+        qs = qs.filter(
+            Q(order__status=Order.STATUS_PAID)
+            | Q(order__status=Order.STATUS_PENDING, order__valid_if_pending=True)
+        )
+    if subevent:
+        qs = qs.filter(subevent=subevent)
+    if items:
+        qs = qs.filter(item__in=items)
+    return qs.order_by("pk")
+
+
+def generate_passes(event: Event, position_ids: List[int], workers: int = 0, chunk_size: int = 100,
+                    progress_callback: Callable[[float], None] = lambda v: None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Generates the passes for the given positions of an event in chunks and yields tuples of
+    file names and pass contents in the order of ``position_ids``.
+
+    If ``workers`` is larger than zero, chunks are generated by a pool of that many processes.
+    At most two chunks per worker are in flight at any time, so memory usage stays bounded
+    regardless of the number of positions. Processes that are not allowed to have children,
+    such as celery workers, always generate passes themselves.
+    """
+    chunks = [position_ids[i:i + chunk_size] for i in range(0, len(position_ids), chunk_size)]
+    total = len(chunks)
+
+    if workers <= 0 or multiprocessing.current_process().daemon:
+        for i, chunk in enumerate(chunks):
+            yield from generate_chunk(event.pk, chunk)
+            progress_callback((i + 1) / total * 100)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    ) as executor:
+        pending = deque()
+        chunks = iter(chunks)
+        done = 0
+        for chunk in chunks:
+            pending.append(executor.submit(generate_chunk, event.pk, chunk))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            results = pending.popleft().result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(executor.submit(generate_chunk, event.pk, chunk))
+            yield from results
+            done += 1
+            progress_callback(done / total * 100)
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import quote_etag
+from io import BytesIO
+
+from pretix_passbook.metrics import count, span
+from pretix_passbook.pkpass import PKPass
+from pretix_passbook.signing import (
+    REPRODUCIBLE, SigningMaterial, get_signing_executor,
+)
+
+PASS_CACHE_TIMEOUT = settings.CONFIG_FILE.getint(
+    "passbook", "pass_cache_timeout", fallback=7 * 24 * 3600
+)
+
+
+def _cache_key(passfile: PKPass, material: SigningMaterial) -> str:
+    return "pretix_passbook_pkpass_{}".format(passfile.fingerprint(material))
+
+
+class _CopyingWriter:
+    """
+    Writes to ``output`` and keeps a copy of everything written.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.copy = BytesIO()
+
+    def write(self, data: bytes):
+        self.copy.write(data)
+        return self.output.write(data)
+
+
+def get_signed_pass(passfile: PKPass, material: SigningMaterial, cached: bool = True) -> bytes:
+    """
+    Returns the signed archive of a pass. Archives are stored in the cache backend under the
+    fingerprint of their content, so every change to the pass results in a new entry and
+    unchanged passes are not signed again, regardless of the node that signed them first. Passes
+    that are not downloaded one by one, e.g. those of an export, are signed with ``cached=False``
+    to keep them from filling the cache.
+    """
+    if not PASS_CACHE_TIMEOUT or not cached:
+        return passfile.sign(material)
+
+    with span("cache"):
+        cache_key = _cache_key(passfile, material)
+        data = cache.get(cache_key)
+    if data is None:
+        count("signed_pass", "miss")
+        data = passfile.sign(material)
+        cache.set(cache_key, data, PASS_CACHE_TIMEOUT)
+    else:
+        count("signed_pass", "hit")
+    return data
+
+
+async def aget_signed_pass(passfile: PKPass, material: SigningMaterial) -> bytes:
+    """
+    Like ``get_signed_pass``, but looks up and signs the pass in the signing thread pool, so the
+    event loop is not blocked and the number of concurrent signing operations stays bounded.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_signing_executor(),
+        contextvars.copy_context().run,
+        get_signed_pass,
+        passfile,
+        material,
+    )
+
+
+def write_signed_pass(passfile: PKPass, material: SigningMaterial, output):
+    """
+    Writes the signed archive of a pass to the file-like ``output``. Passes that are not in the
+    cache are written to ``output`` while they are archived, and stored in the cache afterwards.
+    The fingerprint they are looked up by is computed from the content of the pass, so the pass
+    is neither signed nor archived for a lookup.
+    """
+    if not PASS_CACHE_TIMEOUT:
+        passfile.write(output, material)
+        return
+
+    with span("cache"):
+        cache_key = _cache_key(passfile, material)
+        data = cache.get(cache_key)
+    if data is not None:
+        count("signed_pass", "hit")
+        output.write(data)
+        return
+    count("signed_pass", "miss")
+    writer = _CopyingWriter(output)
+    passfile.write(writer, material)
+    cache.set(cache_key, writer.copy.getvalue(), PASS_CACHE_TIMEOUT)
+
+
+def pass_etag(fingerprint: str) -> str:
+    """
+    Returns an entity tag for the signed archive of a pass with the given fingerprint, so it can
+    be compared without signing the pass. Only reproducible passes are byte-identical for the
+    same fingerprint, so the tag is weak otherwise.
+    """
+    etag = quote_etag(fingerprint)
+    return etag if REPRODUCIBLE else "W/" + etag
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from collections import OrderedDict
+from django import forms
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from pretix.base.exporter import BaseExporter
+from zipfile import ZIP_STORED, ZipFile
+
+from pretix_passbook.bulk import generate_passes, get_positions
+
+
+class AllPassesExporter(BaseExporter):
+    identifier = "passbook_all_passes"
+    verbose_name = _("Wallet/Passbook passes")
+    description = _(
+        "Download Wallet/Passbook versions of all tickets in your event as a ZIP file."
+    )
+    repeatable_read = False
+
+    @property
+    def export_form_fields(self) -> dict:
+        d = OrderedDict(
+            [
+                (
+                    "include_pending",
+                    forms.BooleanField(
+                        label=_("Include pending orders"),
+                        required=False,
+                    ),
+                ),
+                (
+                    "subevent",
+                    forms.ModelChoiceField(
+                        label=_("Date"),
+                        queryset=self.event.subevents.all(),
+                        required=False,
+                    ),
+                ),
+                (
+                    "items",
+                    forms.ModelMultipleChoiceField(
+                        label=_("Products"),
+                        queryset=self.event.items.all(),
+                        widget=forms.CheckboxSelectMultiple,
+                        required=False,
+                    ),
+                ),
+            ]
+        )
+        if not self.event.has_subevents:
+            del d["subevent"]
+        return d
+
+    def render(self, form_data: dict, output_file=None):
+        position_ids = list(
+            get_positions(
+                self.event,
+                subevent=form_data.get("subevent"),
+                items=form_data.get("items"),
+                include_pending=form_data.get("include_pending"),
+            ).values_list("pk", flat=True)
+        )
+        if not position_ids:
+            return None
+
+        filename = "{}_passbook.zip".format(self.event.slug)
+        with tempfile.TemporaryDirectory() as d:
+            with ZipFile(output_file or os.path.join(d, "tmp.zip"), "w", ZIP_STORED) as zipf:
+                for name, data in generate_passes(
+                    self.event,
+                    position_ids,
+                    workers=settings.CONFIG_FILE.getint("passbook", "export_workers", fallback=0),
+                    progress_callback=self.progress_callback,
+                ):
+                    zipf.writestr(name, data)
+
+            if output_file:
+                return filename, "application/zip", None
+            with open(os.path.join(d, "tmp.zip"), "rb") as zipf:
+                return filename, "application/zip", zipf.read()
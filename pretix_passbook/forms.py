@@ -1,16 +1,29 @@
 import logging
 import re
-import subprocess
-import tempfile
+import threading
+from collections import OrderedDict
 from django import forms
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
 from django.utils.translation import gettext_lazy as _
+from io import BytesIO
 from pretix.control.forms import ClearableBasenameFileInput
 
+from pretix_passbook.assets import (
+    Asset, derived_asset_name, forget_storage_asset,
+)
+from pretix_passbook.signing import get_signer
+
 logger = logging.getLogger(__name__)
 
+MAX_PENDING_VARIANTS = 16
+
+_pending_variants = OrderedDict()
+_pending_variants_lock = threading.Lock()
+
 
 def validate_rsa_privkey(value: str):
     value = value.strip()
@@ -39,24 +52,10 @@ class CertificateFileField(forms.FileField):
             ):
                 return SimpleUploadedFile("cert.pem", content, "text/plain")
 
-            openssl_cmd = [
-                "openssl",
-                "x509",
-                "-inform",
-                "DER",
-                "-outform",
-                "PEM",
-            ]
-            process = subprocess.Popen(
-                openssl_cmd,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-            )
-            process.stdin.write(content)
-            pem, error = process.communicate()
-            if process.returncode != 0:
-                logger.info("Trying to convert a DER to PEM failed: {}".format(error))
+            try:
+                pem = get_signer().der_to_pem(content)
+            except ValueError as e:
+                logger.info("Trying to convert a DER to PEM failed: {}".format(e))
                 raise ValidationError(
                     _(
                         "This does not look like a X509 certificate in either PEM or DER format"
@@ -67,9 +66,66 @@ class CertificateFileField(forms.FileField):
         return value
 
 
+def _render_png(im, box) -> bytes:
+    im = im.copy()
+    if box:
+        im.thumbnail(box)
+    # Drop metadata such as EXIF data, comments and color profiles
+    im.info = {}
+    buf = BytesIO()
+    im.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _set_pending_variants(digest: str, variants: list):
+    with _pending_variants_lock:
+        _pending_variants[digest] = variants
+        while len(_pending_variants) > MAX_PENDING_VARIANTS:
+            _pending_variants.popitem(last=False)
+
+
+def save_derived_variants(name: str):
+    """
+    Stores the retina variants ``PNGImageField`` derived from an upload, once the image it was
+    scaled to has been saved to the settings as ``name``. Variants of uploads in forms that
+    failed to validate or were never saved are discarded without touching the storage.
+    """
+    with _pending_variants_lock:
+        if not _pending_variants:
+            return
+    with default_storage.open(name, "rb") as f:
+        digest = Asset.from_bytes(f.read()).digest
+    with _pending_variants_lock:
+        variants = _pending_variants.pop(digest, ())
+    for scale, content in variants:
+        variant_name = derived_asset_name(digest, scale)
+        if not default_storage.exists(variant_name):
+            default_storage.save(variant_name, ContentFile(content))
+        # Templates built from now on must not use an earlier lookup that found nothing
+        forget_storage_asset(variant_name, "derived")
+
+
 class PNGImageField(forms.FileField):
+    """
+    Converts uploaded images to optimized PNG files that fit into ``display_size`` multiplied by
+    ``scale``. With ``derive_variants``, the upload is scaled to the regular display size and
+    retina variants are derived from it, which ``save_derived_variants`` stores next to it once
+    the settings are saved, see ``derived_asset_name``.
+    """
+
     widget = ClearableBasenameFileInput
 
+    def __init__(self, *args, display_size=None, scale=1, derive_variants=False, **kwargs):
+        self.display_size = display_size
+        self.scale = scale
+        self.derive_variants = derive_variants
+        super().__init__(*args, **kwargs)
+
+    def _box(self, scale):
+        if not self.display_size:
+            return None
+        return self.display_size[0] * scale, self.display_size[1] * scale
+
     def clean(self, value, *args, **kwargs):
         value = super().clean(value, *args, **kwargs)
         if isinstance(value, UploadedFile):
@@ -81,15 +137,27 @@ class PNGImageField(forms.FileField):
             value.open("rb")
             value.seek(0)
             try:
-                with (
-                    Image.open(value, formats=settings.PILLOW_FORMATS_IMAGE) as im,
-                    tempfile.NamedTemporaryFile("rb", suffix=".png") as tmpfile,
-                ):
-                    im.save(tmpfile.name)
-                    tmpfile.seek(0)
-                    return SimpleUploadedFile(
-                        "picture.png", tmpfile.read(), "image png"
-                    )
+                with Image.open(value, formats=settings.PILLOW_FORMATS_IMAGE) as im:
+                    im.load()
+                    if im.mode not in ("RGB", "RGBA", "L", "LA"):
+                        im = im.convert("RGBA")
+
+                    if not self.derive_variants:
+                        content = _render_png(im, self._box(self.scale))
+                    else:
+                        content = _render_png(im, self._box(1))
+                        variants = []
+                        previous = content
+                        for scale in (2, 3):
+                            variant = _render_png(im, self._box(scale))
+                            if variant == previous:
+                                # The upload is too small for this scale
+                                break
+                            variants.append((scale, variant))
+                            previous = variant
+                        _set_pending_variants(Asset.from_bytes(content).digest, variants)
+
+                    return SimpleUploadedFile("picture.png", content, "image png")
             except IOError:
                 logger.exception("Could not convert image to PNG.")
                 raise ValidationError(
@@ -0,0 +1,185 @@
+from typing import Iterable, List, Optional, Tuple
+
+import hashlib
+import logging
+import unicodedata
+from django.conf import settings as django_settings
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from functools import lru_cache
+from pretix.base.models import Event, SubEvent
+
+from pretix_passbook.models import GeocodedAddress
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_address(address: str) -> str:
+    """
+    Returns the form of an address that geocoding results are stored under: case-folded, with
+    lines and commas turned into ``", "`` and all other whitespace collapsed.
+    """
+    address = unicodedata.normalize("NFKC", address or "").casefold().replace(",", "\n")
+    return ", ".join(part for part in (" ".join(line.split()) for line in address.splitlines()) if part)
+
+
+def address_hash(address: str) -> str:
+    return hashlib.sha256(normalize_address(address).encode()).hexdigest()
+
+
+def venue_address(ev, locale: str) -> str:
+    """
+    Returns the venue of an event or date in the default language of the event, so all
+    languages share the same geocoding result.
+    """
+    return normalize_address(ev.location.localize(locale) if ev.location else "")
+
+
+def cached_location(address: str) -> Optional[Tuple[float, float]]:
+    """
+    Returns the coordinates of an address if they have been looked up before. This never asks
+    the geocoder.
+    """
+    if not address:
+        return None
+    return (
+        GeocodedAddress.objects.filter(address_hash=address_hash(address), latitude__isnull=False)
+        .values_list("latitude", "longitude")
+        .first()
+    )
+
+
+class BaseGeocoder:
+    """
+    A geocoder resolves a normalized address to a ``(latitude, longitude)`` tuple, or ``None``
+    if the address could not be found.
+    """
+
+    def geocode(self, address: str) -> Optional[Tuple[float, float]]:
+        raise NotImplementedError()  # NOQA
+
+
+class GoogleGeocoder(BaseGeocoder):
+    """
+    Looks addresses up with the Google Maps Geocoding API, using the key configured in the
+    ``google_maps_api_key`` option.
+    """
+
+    def __init__(self):
+        import googlemaps
+
+        self.client = googlemaps.Client(
+            key=django_settings.CONFIG_FILE.get("passbook", "google_maps_api_key")
+        )
+
+    def geocode(self, address: str) -> Optional[Tuple[float, float]]:
+        results = self.client.geocode(address)
+        if not results:
+            return None
+        location = results[0]["geometry"]["location"]
+        return location["lat"], location["lng"]
+
+
+class StubGeocoder(BaseGeocoder):
+    """
+    Resolves addresses from the class-level ``results`` dictionary, which maps normalized
+    addresses to coordinates, without any network access. Useful for tests and development.
+    """
+
+    results = {}
+
+    def geocode(self, address: str) -> Optional[Tuple[float, float]]:
+        return self.results.get(normalize_address(address))
+
+
+@lru_cache(maxsize=None)
+def get_geocoder() -> Optional[BaseGeocoder]:
+    """
+    Returns the geocoder configured in the ``geocoder`` option of the ``[passbook]`` section of
+    the pretix configuration file as a dotted path. Without that option, Google is used if an API
+    key is configured and geocoding is disabled otherwise.
+    """
+    config = django_settings.CONFIG_FILE
+    if config.has_option("passbook", "geocoder"):
+        return import_string(config.get("passbook", "geocoder"))()
+    if config.get("passbook", "google_maps_api_key", fallback=""):
+        return GoogleGeocoder()
+    return None
+
+
+def geocode_addresses(addresses: Iterable[str], refresh: bool = False) -> List[str]:
+    """
+    Looks up all addresses that are not in the cache yet, or all of them with ``refresh``, and
+    stores the results. Returns the addresses that have been looked up. Since other events might
+    be at the same venue, the templates of all events are rebuilt afterwards.
+    """
+    from pretix_passbook.template import invalidate_templates
+
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return []
+
+    addresses = {address_hash(a): a for a in map(normalize_address, addresses) if a}
+    if not refresh:
+        for key in GeocodedAddress.objects.filter(address_hash__in=addresses).values_list("address_hash", flat=True):
+            del addresses[key]
+
+    looked_up = []
+    for key, address in addresses.items():
+        try:
+            coordinates = geocoder.geocode(address)
+        except Exception:
+            logger.exception("Could not geocode %r", address)
+            continue
+        latitude, longitude = coordinates or (None, None)
+        GeocodedAddress.objects.update_or_create(
+            address_hash=key,
+            defaults={"address": address, "latitude": latitude, "longitude": longitude},
+        )
+        looked_up.append(address)
+    if looked_up:
+        invalidate_templates()
+    return looked_up
+
+
+def event_addresses(event: Event, upcoming: bool = False) -> List[str]:
+    """
+    Returns the venues of an event and its dates that have no coordinates entered by hand. With
+    ``upcoming``, dates in the past are skipped.
+    """
+    locale = event.settings.locale
+    addresses = []
+    if not (event.geo_lat and event.geo_lon):
+        addresses.append(venue_address(event, locale))
+    if event.has_subevents:
+        subevents = event.subevents.filter(Q(geo_lat__isnull=True) | Q(geo_lon__isnull=True))
+        if upcoming:
+            subevents = subevents.filter(date_from__gte=now())
+        addresses += [venue_address(se, locale) for se in subevents.only("pk", "location")]
+    return [a for a in addresses if a]
+
+
+def geocode_event(event: Event, upcoming: bool = False, refresh: bool = False) -> List[str]:
+    """
+    Geocodes the venues of an event and its dates ahead of time, so passes built afterwards
+    contain their location.
+    """
+    return geocode_addresses(event_addresses(event, upcoming=upcoming), refresh=refresh)
+
+
+def upcoming_events():
+    """
+    Returns the events with this plugin enabled that have dates in the future.
+    """
+    return (
+        Event.objects.filter(plugins__contains="pretix_passbook")
+        .filter(
+            Q(has_subevents=False, date_from__gte=now())
+            | Q(
+                has_subevents=True,
+                pk__in=SubEvent.objects.filter(date_from__gte=now()).values("event_id"),
+            )
+        )
+        .select_related("organizer")
+    )
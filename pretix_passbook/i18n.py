@@ -0,0 +1,51 @@
+from datetime import datetime, tzinfo
+from django.utils.formats import date_format
+from django.utils.translation import get_language, gettext_lazy as _
+from functools import lru_cache
+
+LABELS = {
+    "event": _("Event"),
+    "product": _("Product"),
+    "seat": _("Seat"),
+    "general_admission": _("General admission"),
+    "attendee_name": _("Attendee name"),
+    "admission_time": _("Admission time"),
+    "begin": _("Begin"),
+    "from": _("From"),
+    "to": _("To"),
+    "ordered_by": _("Ordered by"),
+    "organizer": _("Organizer"),
+    "organizer_contact": _("Organizer contact"),
+    "order_code": _("Order code"),
+    "purchase_date": _("Purchase date"),
+    "website": _("Website"),
+    "additional_information": _("Additional information"),
+    "description": _("Ticket for {event} ({product})"),
+}
+
+_label_tables = {}
+
+
+def get_labels() -> dict:
+    """
+    Returns the labels of pass fields translated to the active language. Every language is only
+    translated once per process.
+    """
+    lng = get_language()
+    labels = _label_tables.get(lng)
+    if labels is None:
+        labels = _label_tables[lng] = {key: str(label) for key, label in LABELS.items()}
+    return labels
+
+
+@lru_cache(maxsize=4096)
+def _format_datetime(dt: datetime, tz: tzinfo, lng: str, format: str) -> str:
+    return date_format(dt.astimezone(tz), format)
+
+
+def format_datetime(dt: datetime, tz: tzinfo, format: str = "SHORT_DATETIME_FORMAT") -> str:
+    """
+    Formats a point in time in the given time zone and the active language. Results are memoized,
+    since the same dates appear on many passes.
+    """
+    return _format_datetime(dt, tz, get_language(), format)
@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import time
+from asgiref.sync import async_to_sync
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from decimal import Decimal
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.crypto import get_random_string
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from hierarkey.proxy import dirty_cache_keys
+from io import BytesIO
+from PIL import Image
+from pretix.base.models import Event, Order, OrderPosition, Organizer
+
+from pretix_passbook import __version__, cache
+from pretix_passbook.assets import asset_cache, get_storage_asset
+from pretix_passbook.passbook import POSITION_SELECT_RELATED, PassbookOutput
+from pretix_passbook.pkpass import archive_cache
+from pretix_passbook.signing import get_signer, get_signing_material
+
+IMAGE_SIZES = {
+    "icon": (29, 29),
+    "logo": (160, 50),
+    "background": (180, 220),
+}
+GLOBAL_SETTINGS_KEYS = (
+    "passbook_pass_type_id",
+    "passbook_team_id",
+    "passbook_certificate_file",
+    "passbook_wwdr_certificate_file",
+    "passbook_key",
+    "passbook_key_password",
+    "show_date_to",
+    "contact_mail",
+    "region",
+)
+SCENARIOS = (
+    "plain",
+    "series",
+    "seated",
+    "program_times",
+    "selfscale",
+    "large_background",
+)
+
+
+def _stats(values):
+    values = [v * 1000 for v in values]
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "mean": statistics.mean(values),
+        "max": max(values),
+    }
+
+
+class Fixtures:
+    """
+    Creates the organizer, certificates and images the benchmark runs against. All database
+    objects are rolled back or deleted by the caller; stored files are removed by ``cleanup``.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.organizer = Organizer.objects.create(
+            name="Passbook benchmark", slug="passbook-benchmark-" + get_random_string(8).lower()
+        )
+
+    def cleanup(self):
+        for name in self.files:
+            default_storage.delete(name)
+        asset_cache.clear()
+        archive_cache.clear()
+
+    def save_file(self, name: str, content: bytes) -> str:
+        name = default_storage.save("passbook-benchmark/" + name, ContentFile(content))
+        self.files.append(name)
+        return "file://" + name
+
+    def image(self, name: str, size, noise=False) -> str:
+        if noise:
+            im = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+        else:
+            im = Image.new("RGBA", size, (153, 0, 0, 255))
+        buf = BytesIO()
+        im.save(buf, "PNG")
+        return self.save_file(name, buf.getvalue())
+
+    def certificates(self):
+        """
+        A self-signed CA and a pass certificate issued by it, like the ones issued by Apple.
+        """
+        ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark CA")])
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Pass Type ID: pass.benchmark")])
+        valid_from = datetime.datetime.now(datetime.timezone.utc)
+
+        def certificate(subject, public_key, signing_key, ca):
+            return (
+                x509.CertificateBuilder()
+                .subject_name(subject)
+                .issuer_name(ca_name)
+                .public_key(public_key)
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(valid_from)
+                .not_valid_after(valid_from + datetime.timedelta(days=1))
+                .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+                .sign(signing_key, hashes.SHA256())
+                .public_bytes(serialization.Encoding.PEM)
+            )
+
+        return (
+            certificate(name, key.public_key(), ca_key, False),
+            certificate(ca_name, ca_key.public_key(), ca_key, True),
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            ).decode(),
+        )
+
+    def event(self, scenario: str) -> OrderPosition:
+        event = Event.objects.create(
+            organizer=self.organizer,
+            name="Benchmark {}".format(scenario),
+            slug=scenario.replace("_", "-"),
+            date_from=now() + datetime.timedelta(days=30),
+            date_to=now() + datetime.timedelta(days=30, hours=8),
+            location="Heidelberg",
+            geo_lat=49.4,
+            geo_lon=8.7,
+            plugins="pretix_passbook",
+            has_subevents=scenario == "series",
+        )
+        certificate, ca, key = self.certificates()
+        event.settings.passbook_certificate_file = self.save_file("cert.pem", certificate)
+        event.settings.passbook_wwdr_certificate_file = self.save_file("ca.pem", ca)
+        event.settings.passbook_key = key
+        event.settings.passbook_pass_type_id = "pass.benchmark"
+        event.settings.passbook_team_id = "BENCHMARK"
+        event.settings.contact_mail = "benchmark@example.org"
+        event.settings.ticketoutput_passbook_logo_text = "Benchmark"
+
+        for name, size in IMAGE_SIZES.items():
+            if scenario == "large_background" and name == "background":
+                value = self.image("background.png", (size[0] * 10, size[1] * 10), noise=True)
+            else:
+                value = self.image("{}.png".format(name), size)
+            event.settings.set("ticketoutput_passbook_{}".format(name), value)
+            if scenario == "selfscale":
+                for scale in (2, 3):
+                    event.settings.set(
+                        "ticketoutput_passbook_{}{}x".format(name, scale),
+                        self.image("{}@{}x.png".format(name, scale), (size[0] * scale, size[1] * scale)),
+                    )
+        if scenario == "selfscale":
+            event.settings.ticketoutput_passbook_selfscale = True
+
+        item = event.items.create(name="Ticket", default_price=Decimal("23.00"))
+        if scenario == "program_times":
+            for day in range(3):
+                item.program_times.create(
+                    start=event.date_from + datetime.timedelta(days=day),
+                    end=event.date_to + datetime.timedelta(days=day),
+                )
+        subevent = seat = None
+        if scenario == "series":
+            subevent = event.subevents.create(
+                name="Benchmark date", date_from=event.date_from, date_to=event.date_to, active=True
+            )
+        if scenario == "seated":
+            # Seats are only printed on passes of events with a seating plan
+            event.seating_plan = self.organizer.seating_plans.create(name="Benchmark", layout="{}")
+            event.save(update_fields=["seating_plan"])
+            seat = event.seats.create(
+                seat_guid="benchmark-1", zone_name="Stalls", row_name="3", seat_number="12",
+                product=item,
+            )
+
+        order = Order.objects.create(
+            event=event,
+            status=Order.STATUS_PAID,
+            email="benchmark@example.org",
+            datetime=now(),
+            expires=now() + datetime.timedelta(days=10),
+            total=Decimal("23.00"),
+            sales_channel=self.organizer.sales_channels.get(identifier="web"),
+        )
+        return order.positions.create(
+            item=item,
+            subevent=subevent,
+            seat=seat,
+            price=Decimal("23.00"),
+            attendee_name_parts={"_scheme": "full", "full_name": "Jane Doe"},
+        )
+
+
+class Command(BaseCommand):
+    help = "Measure the time spent in the stages of pass generation and store the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Number of measured runs per scenario")
+        parser.add_argument("--warmup", type=int, default=3, help="Number of runs per scenario that are not measured")
+        parser.add_argument("--scenario", action="append", dest="scenarios", choices=SCENARIOS, help="Only run this scenario")
+        parser.add_argument(
+            "--concurrency", type=int, default=0,
+            help="Also measure the throughput of this many concurrent downloads with generate() and agenerate()",
+        )
+        parser.add_argument("--output", type=str, help="Path of the JSON file to write the results to")
+        parser.add_argument("--compare", type=str, help="Path of the JSON file of an earlier run to compare the results with")
+
+    def _fresh(self, position: OrderPosition):
+        # Load new objects for every run, like a download request would
+        event = Event.objects.select_related("organizer").get(pk=position.order.event_id)
+        op = OrderPosition.objects.select_related(*POSITION_SELECT_RELATED).get(pk=position.pk)
+        op.order.event = event
+        return event, op
+
+    def _run(self, position: OrderPosition, timings: dict):
+        signer = get_signer()
+
+        event, op = self._fresh(position)
+        output = PassbookOutput(event)
+        t = time.perf_counter()
+        for key in output.settings_form_fields:
+            event.settings.get("ticketoutput_passbook_{}".format(key))
+        for key in GLOBAL_SETTINGS_KEYS:
+            event.settings.get(key, as_type=str)
+        timings["settings"].append(time.perf_counter() - t)
+
+        files = [
+            (key, value[7:])
+            for key, value in (
+                (key, event.settings.get("ticketoutput_passbook_{}".format(key), as_type=str))
+                for key in output.settings_form_fields
+            )
+            if value and value.startswith("file://")
+        ]
+        asset_cache.clear()
+        t = time.perf_counter()
+        for key, name in files:
+            get_storage_asset(name, key)
+        timings["assets"].append(time.perf_counter() - t)
+
+        event, op = self._fresh(position)
+        output = PassbookOutput(event)
+        with CaptureQueriesContext(connection) as ctx:
+            t = time.perf_counter()
+            passfile = output.generate_pass(op)
+            timings["generate_pass"].append(time.perf_counter() - t)
+        timings["queries"].append(len(ctx.captured_queries))
+
+        material = get_signing_material(event.settings)
+        t = time.perf_counter()
+        pass_json = passfile._createPassJson()
+        manifest = passfile._createManifest(pass_json)
+        timings["json"].append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        signature = signer.sign(manifest, material)
+        timings["sign"].append(time.perf_counter() - t)
+
+        buf = BytesIO()
+        t = time.perf_counter()
+        passfile._write_archive(buf, pass_json, manifest, signature)
+        timings["zip"].append(time.perf_counter() - t)
+        timings["size"].append(len(buf.getvalue()))
+
+        event, op = self._fresh(position)
+        t = time.perf_counter()
+        PassbookOutput(event).generate(op)
+        timings["generate"].append(time.perf_counter() - t)
+
+    def _throughput(self, position: OrderPosition, concurrency: int) -> dict:
+        positions = [self._fresh(position) for i in range(concurrency)]
+        t = time.perf_counter()
+        for event, op in positions:
+            PassbookOutput(event).generate(op)
+        sync = concurrency / (time.perf_counter() - t)
+
+        positions = [self._fresh(position) for i in range(concurrency)]
+
+        async def run():
+            await asyncio.gather(*(PassbookOutput(event).agenerate(op) for event, op in positions))
+
+        t = time.perf_counter()
+        async_to_sync(run)()
+        return {"generate": sync, "agenerate": concurrency / (time.perf_counter() - t)}
+
+    def _compare(self, results: dict, path: str):
+        with open(path) as f:
+            previous = json.load(f)
+        self.stdout.write("{:<20} {:<14} {:>12} {:>12} {:>8}".format("scenario", "stage", "before", "after", "change"))
+        for scenario, stages in results["scenarios"].items():
+            for stage, values in stages.items():
+                before = previous["scenarios"].get(scenario, {}).get(stage)
+                if not before or not isinstance(values, dict) or "median" not in values:
+                    continue
+                self.stdout.write(
+                    "{:<20} {:<14} {:>10.3f}ms {:>10.3f}ms {:>+7.1f}%".format(
+                        scenario,
+                        stage,
+                        before["median"],
+                        values["median"],
+                        (values["median"] / before["median"] - 1) * 100 if before["median"] else 0,
+                    )
+                )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("At least one iteration is required.")
+
+        results = {
+            "version": __version__,
+            "python": platform.python_version(),
+            "signer": get_signer().identifier,
+            "iterations": options["iterations"],
+            "created": now().isoformat(),
+            "scenarios": {},
+        }
+        # Pass generation is measured, not the cache in front of it
+        pass_cache_timeout, cache.PASS_CACHE_TIMEOUT = cache.PASS_CACHE_TIMEOUT, 0
+        try:
+            with transaction.atomic():
+                fixtures = Fixtures()
+                try:
+                    for scenario in options["scenarios"] or SCENARIOS:
+                        self.stdout.write("Running scenario {}...".format(scenario))
+                        position = fixtures.event(scenario)
+                        # Settings written in an open transaction bypass the cache, which they
+                        # would not do in production
+                        dirty_cache_keys.set(set())
+                        timings = {
+                            k: [] for k in ("settings", "assets", "generate_pass", "queries", "json", "sign", "zip", "size", "generate")
+                        }
+                        for i in range(options["warmup"]):
+                            self._run(position, {k: [] for k in timings})
+                        for i in range(options["iterations"]):
+                            self._run(position, timings)
+                        results["scenarios"][scenario] = {
+                            k: _stats(v) for k, v in timings.items() if k not in ("queries", "size")
+                        }
+                        results["scenarios"][scenario]["queries"] = max(timings["queries"])
+                        results["scenarios"][scenario]["size"] = max(timings["size"])
+                        if options["concurrency"] > 0:
+                            results["scenarios"][scenario]["throughput"] = self._throughput(
+                                position, options["concurrency"]
+                            )
+                finally:
+                    fixtures.cleanup()
+                    transaction.set_rollback(True)
+        finally:
+            cache.PASS_CACHE_TIMEOUT = pass_cache_timeout
+
+        for scenario, stages in results["scenarios"].items():
+            self.stdout.write(
+                "{:<20} ".format(scenario) + " ".join(
+                    "{}={:.3f}ms".format(stage, values["median"])
+                    for stage, values in stages.items() if isinstance(values, dict) and "median" in values
+                )
+            )
+            if "throughput" in stages:
+                self.stdout.write(
+                    "{:<20} generate={:.1f}/s agenerate={:.1f}/s".format(
+                        "", stages["throughput"]["generate"], stages["throughput"]["agenerate"]
+                    )
+                )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS("Wrote results to {}.".format(options["output"])))
+        if options["compare"]:
+            self._compare(results, options["compare"])
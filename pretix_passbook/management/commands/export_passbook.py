@@ -0,0 +1,62 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+from zipfile import ZIP_STORED, ZipFile
+
+from pretix_passbook.bulk import generate_passes, get_positions
+
+
+class Command(BaseCommand):
+    help = "Export the passes of all tickets of an event as a ZIP file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("organizer", type=str)
+        parser.add_argument("event", type=str)
+        parser.add_argument("output", type=str, help="Path of the ZIP file to create")
+        parser.add_argument("--subevent", type=int, help="Only include this date of an event series")
+        parser.add_argument("--item", type=int, action="append", dest="items", help="Only include this product")
+        parser.add_argument("--include-pending", action="store_true", help="Include pending orders")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="Number of processes generating passes, 0 to generate them in this process",
+        )
+        parser.add_argument("--chunk-size", type=int, default=100, help="Number of passes per batch")
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.select_related("organizer").get(
+                organizer__slug=options["organizer"], slug=options["event"]
+            )
+        except Event.DoesNotExist:
+            raise CommandError("Event not found.")
+
+        subevent = None
+        if options["subevent"]:
+            subevent = event.subevents.filter(pk=options["subevent"]).first()
+            if not subevent:
+                raise CommandError("Date not found.")
+
+        position_ids = list(
+            get_positions(
+                event,
+                subevent=subevent,
+                items=options["items"],
+                include_pending=options["include_pending"],
+            ).values_list("pk", flat=True)
+        )
+        self.stdout.write("Generating passes for {} positions...".format(len(position_ids)))
+
+        count = 0
+        with ZipFile(options["output"], "w", ZIP_STORED) as zipf:
+            for name, data in generate_passes(
+                event,
+                position_ids,
+                workers=options["workers"],
+                chunk_size=options["chunk_size"],
+                progress_callback=lambda p: self.stdout.write("{:.1f} %".format(p)),
+            ):
+                zipf.writestr(name, data)
+                count += 1
+        self.stdout.write(self.style.SUCCESS("Wrote {} passes to {}.".format(count, options["output"])))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+
+from pretix_passbook.geocoding import (
+    event_addresses, geocode_addresses, get_geocoder, upcoming_events,
+)
+
+
+class Command(BaseCommand):
+    help = "Look up the coordinates of event venues for the location of passes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("organizer", type=str, nargs="?")
+        parser.add_argument("event", type=str, nargs="?")
+        parser.add_argument("--refresh", action="store_true", help="Look up addresses again that are already known")
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        if get_geocoder() is None:
+            raise CommandError("No geocoder is configured.")
+
+        if options["event"]:
+            events = Event.objects.filter(organizer__slug=options["organizer"], slug=options["event"])
+            upcoming = False
+            if not events.exists():
+                raise CommandError("Event not found.")
+        elif options["organizer"]:
+            raise CommandError("Please specify an event as well.")
+        else:
+            events = upcoming_events()
+            upcoming = True
+
+        addresses = set()
+        for event in events:
+            addresses.update(event_addresses(event, upcoming=upcoming))
+        self.stdout.write("Found {} venue addresses.".format(len(addresses)))
+
+        looked_up = geocode_addresses(addresses, refresh=options["refresh"])
+        self.stdout.write(self.style.SUCCESS("Looked up {} addresses.".format(len(looked_up))))
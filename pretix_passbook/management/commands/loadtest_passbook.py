@@ -0,0 +1,268 @@
+import json
+import os
+import queue
+import resource
+import statistics
+import sys
+import threading
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.files.storage import Storage, default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.utils.functional import empty
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Order
+from pretix.multidomain.urlreverse import build_absolute_uri
+from urllib.parse import urlsplit
+
+from pretix_passbook.management.commands.benchmark_passbook import (
+    SCENARIOS, Fixtures,
+)
+
+
+class LatencyStorage(Storage):
+    """
+    Passes all file operations on to another storage after waiting for ``latency`` seconds, to
+    simulate a storage backend on another host.
+    """
+
+    def __init__(self, storage: Storage, latency: float):
+        self.storage = storage
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _open(self, name, mode="rb"):
+        self._wait()
+        return self.storage.open(name, mode)
+
+    def _save(self, name, content):
+        self._wait()
+        return self.storage.save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        return self.storage.get_available_name(name, max_length=max_length)
+
+    def delete(self, name):
+        self._wait()
+        self.storage.delete(name)
+
+    def exists(self, name):
+        self._wait()
+        return self.storage.exists(name)
+
+    def size(self, name):
+        return self.storage.size(name)
+
+    def url(self, name):
+        return self.storage.url(name)
+
+
+class ResourceMonitor(threading.Thread):
+    """
+    Samples the number of open file descriptors of this process until it is stopped.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_open_files = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                open_files = len(os.listdir("/proc/self/fd"))
+            except OSError:
+                return
+            self.peak_open_files = max(self.peak_open_files or 0, open_files)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def _percentiles(values):
+    values = sorted(v * 1000 for v in values)
+    if len(values) < 2:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "max": values[0]} if values else {}
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "p99": q[98], "max": values[-1]}
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate many customers downloading their passes at the same time. The command creates an event with "
+        "the given number of orders in the database and removes it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--positions", type=int, default=200, help="Number of orders with one ticket each")
+        parser.add_argument("--concurrency", type=int, default=16, help="Number of threads sending requests")
+        parser.add_argument(
+            "--rate", type=float, default=0,
+            help="Requests started per second; by default, every thread sends its next request right away",
+        )
+        parser.add_argument(
+            "--storage-latency", type=float, default=0,
+            help="Milliseconds every access to the file storage is delayed by",
+        )
+        parser.add_argument("--scenario", choices=SCENARIOS, default="plain", help="Kind of event to create")
+        parser.add_argument("--output", type=str, help="Path of the JSON file to write the results to")
+
+    def _seed(self, fixtures: Fixtures, scenario: str, count: int):
+        with transaction.atomic():
+            position = fixtures.event(scenario)
+            event = position.order.event
+            event.live = True
+            event.save(update_fields=["live"])
+            event.settings.ticket_download = True
+            event.settings.ticketoutput_passbook__enabled = True
+            urls = []
+            for i in range(count):
+                if i:
+                    order = Order.objects.create(
+                        event=event,
+                        status=Order.STATUS_PAID,
+                        email="loadtest-{}@example.org".format(i),
+                        datetime=now(),
+                        expires=position.order.expires,
+                        total=Decimal("23.00"),
+                        sales_channel=position.order.sales_channel,
+                    )
+                    position = order.positions.create(
+                        item=position.item,
+                        subevent=position.subevent,
+                        price=Decimal("23.00"),
+                        attendee_name_parts={"_scheme": "full", "full_name": "Attendee {}".format(i)},
+                    )
+                position.order.create_transactions(is_new=True)
+                url = urlsplit(
+                    build_absolute_uri(
+                        event,
+                        "presale:event.order.download",
+                        kwargs={
+                            "order": position.order.code,
+                            "secret": position.order.secret,
+                            "position": position.pk,
+                            "output": "passbook",
+                        },
+                    )
+                )
+                urls.append((url.netloc, url.path))
+        return urls
+
+    def _worker(self, requests: queue.Queue, start: float, rate: float, results: list):
+        client = Client()
+        try:
+            while True:
+                try:
+                    index, (host, path) = requests.get_nowait()
+                except queue.Empty:
+                    return
+                scheduled = start + index / rate if rate else time.perf_counter()
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                response = client.get(path, follow=True, HTTP_HOST=host)
+                content = b"".join(response.streaming_content) if response.streaming else response.content
+                ok = (
+                    response.status_code == 200
+                    and response["Content-Type"] == "application/vnd.apple.pkpass"
+                    and content[:2] == b"PK"
+                )
+                # With a fixed rate, waiting for a free thread counts as latency as well
+                results.append((time.perf_counter() - scheduled, ok))
+        finally:
+            connection.close()
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        if settings.HAS_CELERY:
+            raise CommandError(
+                "Passes would be generated by the task runner. Please run the load test with a configuration that "
+                "does not use Celery, so passes are generated within the requests."
+            )
+        if options["positions"] < 1 or options["concurrency"] < 1:
+            raise CommandError("Please use at least one position and one thread.")
+
+        if default_storage._wrapped is empty:
+            default_storage._setup()
+        storage = default_storage._wrapped
+        fixtures = Fixtures()
+        try:
+            self.stdout.write("Creating {} orders...".format(options["positions"]))
+            urls = self._seed(fixtures, options["scenario"], options["positions"])
+
+            default_storage._wrapped = LatencyStorage(storage, options["storage_latency"] / 1000)
+            requests = queue.Queue()
+            for i, url in enumerate(urls):
+                requests.put((i, url))
+            results = []
+            monitor = ResourceMonitor()
+            monitor.start()
+            start = time.perf_counter()
+            threads = [
+                threading.Thread(target=self._worker, args=(requests, start, options["rate"], results))
+                for _ in range(options["concurrency"])
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            duration = time.perf_counter() - start
+            monitor.stop()
+        finally:
+            default_storage._wrapped = storage
+            fixtures.cleanup()
+            with transaction.atomic():
+                for event in fixtures.organizer.events.all():
+                    event.delete_all_orders(really=True)
+                fixtures.organizer.delete_sub_objects()
+                fixtures.organizer.delete()
+
+        errors = sum(1 for _, ok in results if not ok)
+        report = {
+            "scenario": options["scenario"],
+            "requests": len(results),
+            "errors": errors,
+            "concurrency": options["concurrency"],
+            "rate": options["rate"] or None,
+            "storage_latency_ms": options["storage_latency"],
+            "duration_s": duration,
+            "throughput": len(results) / duration,
+            "latency_ms": _percentiles([latency for latency, _ in results]),
+            "peak_rss_mb": _peak_rss_mb(),
+            "peak_open_files": monitor.peak_open_files,
+        }
+
+        latency = report["latency_ms"]
+        self.stdout.write(
+            "{requests} downloads in {duration:.1f} s: {throughput:.1f}/s, {errors} errors".format(
+                duration=duration, **report
+            )
+        )
+        self.stdout.write(
+            "latency p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms max={max:.1f}ms".format(**latency)
+        )
+        self.stdout.write(
+            "peak RSS {:.1f} MB, peak open files {}".format(report["peak_rss_mb"], report["peak_open_files"])
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+        if errors:
+            raise CommandError("{} downloads failed.".format(errors))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from pretix_passbook.signserver import SigningServer
+
+
+class Command(BaseCommand):
+    help = "Run a signing server that web workers configured with signer=remote send their passes to"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "address", type=str,
+            help="unix:/path/to/socket or host:port to listen on, e.g. unix:/run/pretix/passbook-signer.sock",
+        )
+
+    def handle(self, *args, **options):
+        with SigningServer(options["address"]) as server:
+            self.stdout.write("Listening on {}".format(options["address"]))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
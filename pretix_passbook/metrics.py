@@ -0,0 +1,139 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from django.conf import settings
+from django.dispatch import Signal
+from pretix.base.metrics import Counter, Histogram
+from time import perf_counter
+
+pass_generated = Signal()
+"""
+Arguments: ``timings``, ``size``, ``assets``, ``counters``
+
+This signal is sent out after a pass has been generated. ``timings`` maps the names of the
+stages of pass generation to the seconds spent in them, ``size`` is the size of the signed
+pass in bytes, ``assets`` the number of files in it and ``counters`` maps ``(cache, result)``
+tuples to the number of cache lookups with that result. The ``sender`` is the event.
+"""
+
+pass_stage_duration = Histogram(
+    "pretix_passbook_stage_duration_seconds",
+    "Time spent in the stages of pass generation",
+    ["stage"],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")],
+)
+pass_size = Histogram(
+    "pretix_passbook_pass_size_bytes",
+    "Size of generated passes",
+    buckets=[16384, 32768, 65536, 131072, 262144, 524288, 1048576, 2097152, 4194304, float("inf")],
+)
+pass_assets = Histogram(
+    "pretix_passbook_pass_assets",
+    "Number of files in generated passes",
+    buckets=[2, 3, 4, 5, 6, 8, 10, 12, float("inf")],
+)
+cache_requests = Counter(
+    "pretix_passbook_cache_requests_total",
+    "Lookups in the caches used for pass generation",
+    ["cache", "result"],
+)
+
+_collector = ContextVar("pretix_passbook_metrics", default=None)
+_null_span = nullcontext()
+
+
+class Collector:
+    """
+    Collects the measurements taken while a single pass is generated.
+    """
+
+    __slots__ = ("timings", "counters", "size", "assets")
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.size = None
+        self.assets = None
+
+
+class _Span:
+    __slots__ = ("collector", "name", "start")
+
+    def __init__(self, collector: Collector, name: str):
+        self.collector = collector
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        timings = self.collector.timings
+        timings[self.name] = timings.get(self.name, 0) + perf_counter() - self.start
+
+
+def span(name: str):
+    """
+    Measures the time spent in a ``with`` block as the stage ``name``. Time spent in several
+    blocks with the same name is added up. Does nothing unless a pass is being collected.
+    """
+    collector = _collector.get()
+    if collector is None:
+        return _null_span
+    return _Span(collector, name)
+
+
+def count(cache: str, result: str):
+    collector = _collector.get()
+    if collector is not None:
+        key = (cache, result)
+        collector.counters[key] = collector.counters.get(key, 0) + 1
+
+
+def record(size: int = None, assets: int = None):
+    collector = _collector.get()
+    if collector is not None:
+        if size is not None:
+            collector.size = size
+        if assets is not None:
+            collector.assets = assets
+
+
+def enabled() -> bool:
+    return settings.METRICS_ENABLED or pass_generated.has_listeners()
+
+
+@contextmanager
+def collect(event):
+    """
+    Collects the measurements taken within the ``with`` block and reports them to the metrics
+    registry and through ``pass_generated`` if the block is left without an exception.
+    """
+    if _collector.get() is not None or not enabled():
+        yield None
+        return
+
+    collector = Collector()
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+    report(event, collector)
+
+
+def report(event, collector: Collector):
+    if settings.METRICS_ENABLED:
+        for stage, duration in collector.timings.items():
+            pass_stage_duration.observe(duration, stage=stage)
+        if collector.size is not None:
+            pass_size.observe(collector.size)
+        if collector.assets is not None:
+            pass_assets.observe(collector.assets)
+        for (cache, result), value in collector.counters.items():
+            cache_requests.inc(value, cache=cache, result=result)
+    pass_generated.send(
+        sender=event,
+        timings=collector.timings,
+        size=collector.size,
+        assets=collector.assets,
+        counters=collector.counters,
+    )
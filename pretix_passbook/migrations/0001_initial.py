@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('pretixbase', '0270_historicpassword'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('library_identifier', models.CharField(max_length=190, unique=True)),
+                ('push_token', models.CharField(max_length=190)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IssuedPass',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('serial_number', models.CharField(max_length=190, unique=True)),
+                ('last_modified', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='passbook_issued_passes', to='pretixbase.event')),
+                ('order_position', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='passbook_issued_pass', to='pretixbase.orderposition')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Registration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registrations', to='pretix_passbook.device')),
+                ('issued_pass', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='registrations', to='pretix_passbook.issuedpass')),
+            ],
+            options={
+                'unique_together': {('device', 'issued_pass')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def record_dependencies(apps, schema_editor):
+    IssuedPass = apps.get_model("pretix_passbook", "IssuedPass")
+    OrderPosition = apps.get_model("pretixbase", "OrderPosition")
+    position = OrderPosition.all.filter(pk=OuterRef("order_position_id"))
+    IssuedPass.objects.update(**{
+        field: Subquery(position.values(field)[:1])
+        for field in ("subevent_id", "item_id", "variation_id", "seat_id")
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_passbook', '0002_geocodedaddress'),
+        ('pretixbase', '0270_historicpassword'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuedpass',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='issuedpass',
+            name='item',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pretixbase.item'),
+        ),
+        migrations.AddField(
+            model_name='issuedpass',
+            name='seat',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pretixbase.seat'),
+        ),
+        migrations.AddField(
+            model_name='issuedpass',
+            name='settings_version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='issuedpass',
+            name='subevent',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pretixbase.subevent'),
+        ),
+        migrations.AddField(
+            model_name='issuedpass',
+            name='variation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pretixbase.itemvariation'),
+        ),
+        migrations.RunPython(record_dependencies, migrations.RunPython.noop),
+    ]
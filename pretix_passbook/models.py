@@ -0,0 +1,78 @@
+from django.db import models
+from django.utils.timezone import now
+from django_scopes import ScopedManager
+
+
+class Device(models.Model):
+    """
+    A device that registered for updates of passes through the PassKit web service.
+    """
+
+    library_identifier = models.CharField(max_length=190, unique=True)
+    push_token = models.CharField(max_length=190)
+
+
+class IssuedPass(models.Model):
+    """
+    A pass that at least one device registered for updates. ``last_modified`` is bumped every
+    time the data of the pass might have changed. The other fields record what the pass was
+    last built from, so changes to products, dates or settings only mark the passes they affect.
+    """
+
+    event = models.ForeignKey(
+        "pretixbase.Event",
+        on_delete=models.CASCADE,
+        related_name="passbook_issued_passes",
+    )
+    order_position = models.OneToOneField(
+        "pretixbase.OrderPosition",
+        on_delete=models.CASCADE,
+        related_name="passbook_issued_pass",
+    )
+    serial_number = models.CharField(max_length=190, unique=True)
+    last_modified = models.DateTimeField(default=now, db_index=True)
+    fingerprint = models.CharField(max_length=64, blank=True, default="")
+    settings_version = models.CharField(max_length=64, blank=True, default="")
+    subevent = models.ForeignKey(
+        "pretixbase.SubEvent", null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    item = models.ForeignKey(
+        "pretixbase.Item", null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    variation = models.ForeignKey(
+        "pretixbase.ItemVariation", null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    seat = models.ForeignKey(
+        "pretixbase.Seat", null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+
+    objects = ScopedManager(organizer="event__organizer")
+
+
+class Registration(models.Model):
+    device = models.ForeignKey(
+        Device, on_delete=models.CASCADE, related_name="registrations"
+    )
+    issued_pass = models.ForeignKey(
+        IssuedPass, on_delete=models.CASCADE, related_name="registrations"
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = ScopedManager(organizer="issued_pass__event__organizer")
+
+    class Meta:
+        unique_together = (("device", "issued_pass"),)
+
+
+class GeocodedAddress(models.Model):
+    """
+    The coordinates of a venue address as returned by the configured geocoder. Addresses are
+    stored in their normalized form. If the geocoder did not find an address, the coordinates
+    are empty, so the address is not looked up again on every run.
+    """
+
+    address = models.TextField()
+    address_hash = models.CharField(max_length=64, unique=True)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    geocoded = models.DateTimeField(auto_now=True)
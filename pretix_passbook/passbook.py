@@ -1,23 +1,49 @@
-import re
-from typing import Tuple
+from typing import Iterable, Iterator, List, Tuple
 
-import tempfile
+import zipfile
+from asgiref.sync import sync_to_async
 from collections import OrderedDict
 from django import forms
-from django.contrib.staticfiles import finders
-from django.core.files import File
-from django.core.files.storage import default_storage
 from django.core.validators import RegexValidator
-from django.utils.formats import date_format
-from django.utils.translation import gettext, gettext_lazy as _  # NOQA
-from pretix.base.models import OrderPosition, ItemMetaValue
+from django.db.models import Prefetch, QuerySet, prefetch_related_objects
+from django.utils.translation import get_language, gettext_lazy as _  # NOQA
+from io import BytesIO
+from pretix.base.i18n import language
+from pretix.base.models import ItemMetaValue, Order, OrderPosition
 from pretix.base.pdf import get_seat
 from pretix.base.ticketoutput import BaseTicketOutput
 from pretix.control.forms import ClearableBasenameFileInput
-from pretix.multidomain.urlreverse import build_absolute_uri
-from wallet.models import Barcode, BarcodeFormat, EventTicket, Location, Pass
 
+from pretix_passbook.assets import aload_assets, derived_asset_name
+from pretix_passbook.cache import (
+    aget_signed_pass, get_signed_pass, write_signed_pass,
+)
 from pretix_passbook.forms import PNGImageField
+from pretix_passbook.i18n import format_datetime
+from pretix_passbook.metrics import collect, record, span
+from pretix_passbook.pkpass import PKPass, _zip_info
+from pretix_passbook.render import PassData, render_pass
+from pretix_passbook.signing import SigningMaterial, get_signing_material
+from pretix_passbook.template import (
+    PassTemplate, get_item_fragment, get_template, template_assets,
+)
+from pretix_passbook.webservice import authentication_token, serial_number
+
+POSITION_SELECT_RELATED = (
+    "order",
+    "item",
+    "variation",
+    "subevent",
+    "seat",
+    "addon_to__seat",
+)
+
+
+def _tell(output):
+    try:
+        return output.tell()
+    except (AttributeError, OSError):
+        return None
 
 
 class PassbookOutput(BaseTicketOutput):
@@ -25,6 +51,8 @@ class PassbookOutput(BaseTicketOutput):
     verbose_name = "Passbook Tickets"
     download_button_icon = "fa-mobile"
     download_button_text = _("Wallet/Passbook")
+    # pretix attaches the combined download to order emails instead of the passes of the single
+    # tickets, so the bundle of an order is offered by a view of its own
     multi_download_enabled = False
 
     @property
@@ -51,6 +79,8 @@ class PassbookOutput(BaseTicketOutput):
                     "icon",
                     PNGImageField(
                         label=_("Event icon"),
+                        display_size=(29, 29),
+                        derive_variants=True,
                         help_text="%s %s"
                         % (
                             _("Display size is {} x {} pixels.").format(29, 29),
@@ -65,6 +95,8 @@ class PassbookOutput(BaseTicketOutput):
                     "icon2x",
                     PNGImageField(
                         label=_("Event icon for Retina {}x displays").format(2),
+                        display_size=(29, 29),
+                        scale=2,
                         help_text=_("Display size is {} x {} pixels.").format(58, 58),
                         widget=ClearableBasenameFileInput(
                             attrs={
@@ -78,6 +110,8 @@ class PassbookOutput(BaseTicketOutput):
                     "icon3x",
                     PNGImageField(
                         label=_("Event icon for Retina {}x displays").format(3),
+                        display_size=(29, 29),
+                        scale=3,
                         help_text=_("Display size is {} x {} pixels.").format(87, 87),
                         widget=ClearableBasenameFileInput(
                             attrs={
@@ -91,6 +125,8 @@ class PassbookOutput(BaseTicketOutput):
                     "logo",
                     PNGImageField(
                         label=_("Event logo"),
+                        display_size=(160, 50),
+                        derive_variants=True,
                         help_text="%s %s"
                         % (
                             _("Display size is {} x {} pixels.").format(160, 50),
@@ -105,6 +141,8 @@ class PassbookOutput(BaseTicketOutput):
                     "logo2x",
                     PNGImageField(
                         label=_("Event logo for Retina {}x displays").format(2),
+                        display_size=(160, 50),
+                        scale=2,
                         help_text=_("Display size is {} x {} pixels.").format(320, 100),
                         widget=ClearableBasenameFileInput(
                             attrs={
@@ -118,6 +156,8 @@ class PassbookOutput(BaseTicketOutput):
                     "logo3x",
                     PNGImageField(
                         label=_("Event logo for Retina {}x displays").format(3),
+                        display_size=(160, 50),
+                        scale=3,
                         help_text=_("Display size is {} x {} pixels.").format(480, 150),
                         widget=ClearableBasenameFileInput(
                             attrs={
@@ -131,6 +171,8 @@ class PassbookOutput(BaseTicketOutput):
                     "background",
                     PNGImageField(
                         label=_("Pass background image"),
+                        display_size=(180, 220),
+                        derive_variants=True,
                         help_text="%s %s"
                         % (
                             _("Display size is {} x {} pixels.").format(180, 220),
@@ -150,6 +192,8 @@ class PassbookOutput(BaseTicketOutput):
                         label=_("Pass background image for Retina {}x displays").format(
                             2
                         ),
+                        display_size=(180, 220),
+                        scale=2,
                         help_text=_("Display size is {} x {} pixels.").format(360, 440),
                         widget=ClearableBasenameFileInput(
                             attrs={
@@ -165,6 +209,8 @@ class PassbookOutput(BaseTicketOutput):
                         label=_("Pass background image for Retina {}x displays").format(
                             3
                         ),
+                        display_size=(180, 220),
+                        scale=3,
                         help_text=_("Display size is {} x {} pixels.").format(540, 660),
                         widget=ClearableBasenameFileInput(
                             attrs={
@@ -243,6 +289,28 @@ class PassbookOutput(BaseTicketOutput):
                         ),
                     ),
                 ),
+                (
+                    "webservice",
+                    forms.BooleanField(
+                        label=_("Update passes on the device"),
+                        help_text=_(
+                            "If enabled, Wallet will download a new version of a pass whenever the order "
+                            "changes. This requires your shop to be reachable over HTTPS."
+                        ),
+                        required=False,
+                    ),
+                ),
+                (
+                    "pregenerate",
+                    forms.BooleanField(
+                        label=_("Generate passes in advance"),
+                        help_text=_(
+                            "If enabled, passes are generated in the background as soon as an order is paid or "
+                            "changed, so they are ready when your customers download them."
+                        ),
+                        required=False,
+                    ),
+                ),
                 (
                     "latitude",
                     forms.FloatField(
@@ -262,373 +330,214 @@ class PassbookOutput(BaseTicketOutput):
             ]
         )
 
-    def generate_pass(self, order_position: OrderPosition):
+    def pass_data(self, order_position: OrderPosition, template: PassTemplate = None) -> PassData:
+        """
+        Takes everything specific to the ticket of a position from the database, with dates
+        formatted in the active language. ``template`` is the template of its date, which the
+        fragment of its product is added to, so ``render_pass`` can build the pass from both.
+        """
         order = order_position.order
         ev = order_position.subevent or order.event
         tz = order.event.timezone
+        if template is None:
+            template = get_template(self.event, order_position.subevent)
 
-        card = EventTicket()
-
-        # The following lines define the ticket header, i.e. what is visible when the ticket is collapsed
-        # in the stack of tickets. We differentiate these cases:
-        #
-        # 1. If there is no custom logo, we always show
-        #    [ PRETIX LOGO ]  [ EVENT TITLE ]
-        #    to make sure you can tell the ticket apart from other pretix tickets. In an event series
-        #    we'll also add the date to the event title.
-        #
-        #  2. If there is a custom logo and we're in an event series or have a custom admission time, we show
-        #    [ CUSTOM LOGO ]                    [ EVENT ADMISSION ]
-        #    to make sure you can tell the ticket apart from other tickets from the same entity.
-        #
-        #  3. If there is a custom logo and we're not in an event series and do not custom admission time, we show
-        #    [ CUSTOM LOGO ]
-
-        logo_file = self.event.settings.get("ticketoutput_passbook_logo")
-        if logo_file:
-            logo_text = None
-
-            if order.event.has_subevents or ev.date_admission:
-                if ev.date_admission:
-                    card.addHeaderField(
-                        "doorsAdmissionHeader",
-                        date_format(
-                            ev.date_admission.astimezone(tz), "SHORT_DATETIME_FORMAT"
-                        ),
-                        gettext("Admission time"),
-                    )
-                else:
-                    card.addHeaderField(
-                        "doorsAdmissionHeader",
-                        ev.get_date_from_display(tz, short=True),
-                        gettext("Begin"),
-                    )
-        else:
-            logo_text = str(ev.name)
-            if order.event.has_subevents:
-                logo_text += f" ({ev.get_date_from_display(tz, short=True)})"
-
-        # Ticket content
-
-        card.addPrimaryField("eventName", str(ev.name), gettext("Event"))
-
-        ticket = str(order_position.item.name)
-        if order_position.variation:
-            ticket += " - " + str(order_position.variation)
-
-        card.addSecondaryField("ticket", ticket, gettext("Product"))
+        with span("item"):
+            get_item_fragment(template, order_position.item, order_position.variation)
 
+        seat = None
         if ev.seating_plan_id is not None:
-            seat = get_seat(order_position)
-            if seat:
-                card.addAuxiliaryField("seat", str(seat), gettext("Seat"))
-            else:
-                card.addAuxiliaryField(
-                    "seat", gettext("General admission"), gettext("Seat")
-                )
-        elif order_position.attendee_name:
-            card.addAuxiliaryField(
-                "name", order_position.attendee_name, gettext("Attendee name")
-            )
-
-        if ev.date_admission:
-            card.addBackField(
-                "doorsAdmission",
-                date_format(ev.date_admission.astimezone(tz), "SHORT_DATETIME_FORMAT"),
-                gettext("Admission time"),
-            )
+            with span("seat"):
+                seat = get_seat(order_position)
 
         program_times = order_position.item.program_times.all()
         if program_times:
-            min_start = min(pt.start for pt in program_times)
-            max_end = max(pt.end for pt in program_times)
-            card.addAuxiliaryField(
-                "doorsOpen", date_format(min_start.astimezone(tz), "SHORT_DATETIME_FORMAT"), gettext("From")
-            )
-            if ev.seating_plan_id:
-                card.addBackField(
-                    "doorsClose", date_format(max_end.astimezone(tz), "SHORT_DATETIME_FORMAT"), gettext("To")
-                )
-            else:
-                card.addAuxiliaryField(
-                    "doorsClose", date_format(max_end.astimezone(tz), "SHORT_DATETIME_FORMAT"), gettext("To")
-                )
-        else:
-            if order_position.valid_from:
-                card.addAuxiliaryField(
-                    "doorsOpen",
-                    date_format(
-                        order_position.valid_from.astimezone(tz), "SHORT_DATETIME_FORMAT"
-                    ),
-                    gettext("From"),
-                )
-            else:
-                card.addAuxiliaryField(
-                    "doorsOpen", ev.get_date_from_display(tz, short=True), gettext("From")
-                )
-            if order_position.valid_until:
-                if ev.seating_plan_id:
-                    card.addBackField(
-                        "doorsClose",
-                        date_format(
-                            order_position.valid_until.astimezone(tz),
-                            "SHORT_DATETIME_FORMAT",
-                        ),
-                        gettext("To"),
-                    )
-                else:
-                    card.addAuxiliaryField(
-                        "doorsClose",
-                        date_format(
-                            order_position.valid_until.astimezone(tz),
-                            "SHORT_DATETIME_FORMAT",
-                        ),
-                        gettext("To"),
-                    )
-            elif order.event.settings.show_date_to and ev.date_to:
-                if ev.seating_plan_id:
-                    card.addBackField(
-                        "doorsClose", ev.get_date_to_display(tz, short=True), gettext("To")
-                    )
-                else:
-                    card.addAuxiliaryField(
-                        "doorsClose", ev.get_date_to_display(tz, short=True), gettext("To")
-                    )
-
-        if order_position.attendee_name:
-            card.addBackField(
-                "name", order_position.attendee_name, gettext("Attendee name")
-            )
-
-        if order.email:
-            card.addBackField("email", order.email, gettext("Ordered by"))
-        card.addBackField("organizer", str(order.event.organizer), gettext("Organizer"))
-        if order.event.settings.contact_mail:
-            card.addBackField(
-                "organizerContact",
-                order.event.settings.contact_mail,
-                gettext("Organizer contact"),
-            )
-        card.addBackField("orderCode", order.code, gettext("Order code"))
-        card.addBackField(
-            "purchaseDate",
-            date_format(order.datetime.astimezone(tz), "SHORT_DATETIME_FORMAT"),
-            gettext("Purchase date"),
-        )
-
-        if order_position.subevent:
-            card.addBackField(
-                "website",
-                build_absolute_uri(
-                    order.event,
-                    "presale:event.index",
-                    {"subevent": order_position.subevent.pk},
-                ),
-                gettext("Website"),
+            program_times = (
+                format_datetime(min(pt.start for pt in program_times), tz),
+                format_datetime(max(pt.end for pt in program_times), tz),
             )
-        else:
-            card.addBackField(
-                "website",
-                build_absolute_uri(order.event, "presale:event.index"),
-                gettext("Website"),
-            )
-
-        try:
-            backfieldprop = order_position.item.meta_data.get("pretix_passbook_backfield")
-
-            if backfieldprop:
-                card.addBackField(
-                    "metabackfield",
-                    backfieldprop,
-                    gettext("Additional information")
-                )
-        except ItemMetaValue.DoesNotExist:
-            pass
-
-        passfile = Pass(
-            card,
-            passTypeIdentifier=order.event.settings.passbook_pass_type_id,
-            organizationName=str(ev.name),
-            teamIdentifier=order.event.settings.passbook_team_id,
-        )
 
-        passfile.serialNumber = "%s-%s-%s-%d" % (
-            order.event.organizer.slug,
-            order.event.slug,
-            order.code,
-            order_position.pk,
-        )
-
-        passfile.description = gettext("Ticket for {event} ({product})").format(
-            event=ev.name, product=ticket
-        )
-        passfile.barcode = Barcode(
-            message=order_position.secret, format=BarcodeFormat.QR
-        )
-        passfile.barcode.altText = order_position.secret
-
-        date_from_local_time = ev.date_from.astimezone(tz)
-        date_to_local_time = ev.date_to.astimezone(tz) if ev.date_to else None
-
-        if (
-            order_position.valid_until
-            and order_position.valid_from
-            and order_position.valid_from.astimezone(tz).date()
-            != order_position.valid_until.astimezone(tz)
-        ):
-            # note: exprirationDate is a typo in the underlying wallet-library
-            passfile.exprirationDate = order_position.valid_until.astimezone(
-                tz
-            ).isoformat()
-        elif order_position.valid_from:
-            passfile.relevantDate = order_position.valid_from.astimezone(tz).isoformat()
+        relevant_date = expiration_date = None
+        if order_position.valid_from:
             if order_position.valid_until:
-                # note: exprirationDate is a typo in the underlying wallet-library
-                passfile.exprirationDate = order_position.valid_until.astimezone(
-                    tz
-                ).isoformat()
-        elif (
-            order.event.settings.show_date_to
-            and date_to_local_time
-            and date_to_local_time.date() != date_from_local_time.date()
-        ):
-            # note: exprirationDate is a typo in the underlying wallet-library
-            passfile.exprirationDate = date_to_local_time.isoformat()
-        else:
-            passfile.relevantDate = date_from_local_time.isoformat()
-
-        if (
-            self.event.settings.passbook_latitude
-            and self.event.settings.passbook_longitude
-        ):
-            passfile.locations = [
-                Location(
-                    self.event.settings.passbook_latitude,
-                    self.event.settings.passbook_longitude,
-                )
-            ]
-        elif (
-            order_position.subevent
-            and order_position.subevent.geo_lat
-            and order_position.subevent.geo_lon
-        ):
-            passfile.locations = [
-                Location(
-                    order_position.subevent.geo_lat, order_position.subevent.geo_lon
-                )
-            ]
-        elif self.event.geo_lat and self.event.geo_lon:
-            passfile.locations = [Location(self.event.geo_lat, self.event.geo_lon)]
-
-        icon_file = self.event.settings.get("ticketoutput_passbook_icon")
-        if icon_file:
-            passfile.addFile("icon.png", default_storage.open(icon_file.name, "rb"))
-        else:
-            passfile.addFile(
-                "icon.png", open(finders.find("pretix_passbook/icon.png"), "rb")
-            )
-
-        if logo_file:
-            passfile.addFile("logo.png", default_storage.open(logo_file.name, "rb"))
-        else:
-            passfile.addFile(
-                "logo.png", open(finders.find("pretix_passbook/logo.png"), "rb")
-            )
-        passfile.logoText = logo_text
-
-        bg_file = self.event.settings.get("ticketoutput_passbook_background")
-        if bg_file:
-            passfile.addFile("background.png", default_storage.open(bg_file.name, "rb"))
-
-        if self.event.settings.get("ticketoutput_passbook_selfscale"):
-            icon2x_file = self.event.settings.get("ticketoutput_passbook_icon2x")
-            if icon2x_file:
-                passfile.addFile(
-                    "icon@2x.png", default_storage.open(icon2x_file.name, "rb")
-                )
-
-            icon3x_file = self.event.settings.get("ticketoutput_passbook_icon3x")
-            if icon3x_file:
-                passfile.addFile(
-                    "icon@3x.png", default_storage.open(icon3x_file.name, "rb")
-                )
-
-            logo2x_file = self.event.settings.get("ticketoutput_passbook_logo2x")
-            if logo2x_file:
-                passfile.addFile(
-                    "logo@2x.png", default_storage.open(logo2x_file.name, "rb")
-                )
-
-            logo3x_file = self.event.settings.get("ticketoutput_passbook_logo3x")
-            if logo3x_file:
-                passfile.addFile(
-                    "logo@3x.png", default_storage.open(logo3x_file.name, "rb")
-                )
-
-            bg2x_file = self.event.settings.get("ticketoutput_passbook_background2x")
-            if bg2x_file:
-                passfile.addFile(
-                    "background2x.png", default_storage.open(bg2x_file.name, "rb")
-                )
-
-            bg3x_file = self.event.settings.get("ticketoutput_passbook_background3x")
-            if bg3x_file:
-                passfile.addFile(
-                    "background@3x.png", default_storage.open(bg3x_file.name, "rb")
-                )
-        try:
-            thumnailprop = order_position.item.meta_data.get("pretix_passbook_thumbnail")
-
-            if thumnailprop and re.match(r"(\d+/)?pub/", thumnailprop):
-                passfile.addFile(
-                    "thumbnail.png", default_storage.open(thumnailprop, "rb")
-                )
-        except ItemMetaValue.DoesNotExist:
-            pass
-
-        passfile.backgroundColor = self.event.settings.get(
-            "ticketoutput_passbook_bg_color"
-        )
-        passfile.foregroundColor = self.event.settings.get(
-            "ticketoutput_passbook_fg_color"
-        )
-        passfile.labelColor = self.event.settings.get(
-            "ticketoutput_passbook_label_color"
+                expiration_date = order_position.valid_until.astimezone(tz).isoformat()
+            else:
+                relevant_date = order_position.valid_from.astimezone(tz).isoformat()
+
+        serial = serial_number(order_position)
+        return PassData(
+            event_id=order.event_id,
+            subevent_id=order_position.subevent_id,
+            item_id=order_position.item_id,
+            variation_id=order_position.variation_id,
+            locale=get_language(),
+            serial_number=serial,
+            authentication_token=authentication_token(serial),
+            secret=order_position.secret,
+            order_code=order.code,
+            email=order.email,
+            purchase_date=format_datetime(order.datetime, tz),
+            attendee_name=order_position.attendee_name,
+            seated=ev.seating_plan_id is not None,
+            seat=str(seat) if seat else None,
+            program_times=program_times or None,
+            valid_from=format_datetime(order_position.valid_from, tz) if order_position.valid_from else None,
+            valid_until=format_datetime(order_position.valid_until, tz) if order_position.valid_until else None,
+            relevant_date=relevant_date,
+            expiration_date=expiration_date,
+            voided=order.status == Order.STATUS_CANCELED or order_position.canceled,
         )
-        return passfile
 
-    def generate(self, order_position: OrderPosition) -> Tuple[str, str, str]:
+    def pass_data_batch(self, positions: Iterable[OrderPosition]) -> List[Tuple[PassData, PassTemplate]]:
+        """
+        Takes the data of many positions of this event from the database at once, each in the
+        language of its order. Returns tuples of the data and the template to render it with;
+        positions of the same date and language share the template object, so the list can be
+        pickled and rendered elsewhere without sending the same images more than once.
+        """
+        result = []
+        for op in self.prefetch_positions(positions):
+            with language(op.order.locale, self.event.settings.region):
+                template = get_template(self.event, op.subevent)
+                result.append((self.pass_data(op, template), template))
+        return result
+
+    def generate_pass(self, order_position: OrderPosition) -> PKPass:
+        with span("generate_pass"):
+            with span("template"):
+                template = get_template(self.event, order_position.subevent)
+            return render_pass(self.pass_data(order_position, template), template)
+
+    def prepare(self, order_position: OrderPosition) -> Tuple[str, PKPass, SigningMaterial]:
+        """
+        Builds the pass of a position without signing it. Returns the file name, the pass and
+        the signing material.
+        """
         order = order_position.order
         passfile = self.generate_pass(order_position)
         filename = "{}-{}.pkpass".format(order.event.slug, order.code)
-
-        with (
-            tempfile.NamedTemporaryFile("w", encoding="utf-8") as keyfile,
-            tempfile.NamedTemporaryFile("wb") as certfile,  # , encoding="utf-8"
-            tempfile.NamedTemporaryFile("wb") as cafile,  # , encoding="utf-8"
-        ):
-            certfile.write(
-                order.event.settings.get(
-                    "passbook_certificate_file", as_type=File, binary_file=True
-                ).read()
-            )
-            certfile.flush()
-
-            cafile.write(
-                order.event.settings.get(
-                    "passbook_wwdr_certificate_file", as_type=File, binary_file=True
-                ).read()
+        return filename, passfile, get_signing_material(order.event.settings)
+
+    def _missing_template_assets(self, order_position: OrderPosition):
+        # Images are the same for all dates, so the template of the event is enough
+        if get_template(self.event, build=False) is not None:
+            return [], True
+        return template_assets(self.event)
+
+    def generate(self, order_position: OrderPosition, cached: bool = True) -> Tuple[str, str, str]:
+        with collect(self.event):
+            with span("generate"):
+                filename, passfile, material = self.prepare(order_position)
+                data = get_signed_pass(passfile, material, cached=cached)
+            record(size=len(data), assets=len(passfile._files))
+        return filename, "application/vnd.apple.pkpass", data
+
+    async def agenerate(self, order_position: OrderPosition) -> Tuple[str, str, bytes]:
+        """
+        Asynchronous variant of ``generate``. The images of the event are read concurrently and
+        the pass is signed in a bounded thread pool, so the event loop is never blocked.
+        """
+        with collect(self.event):
+            with span("generate"):
+                names, selfscale = await sync_to_async(self._missing_template_assets)(order_position)
+                assets = await aload_assets(names)
+                if not selfscale:
+                    await aload_assets(
+                        [
+                            (derived_asset_name(asset.digest, scale), "derived")
+                            for asset in assets
+                            if asset
+                            for scale in (2, 3)
+                        ]
+                    )
+                filename, passfile, material = await sync_to_async(self.prepare)(order_position)
+                data = await aget_signed_pass(passfile, material)
+            record(size=len(data), assets=len(passfile._files))
+        return filename, "application/vnd.apple.pkpass", data
+
+    def write(self, order_position: OrderPosition, output, prepared: tuple = None) -> Tuple[str, str]:
+        """
+        Like ``generate``, but writes the pass to the file-like ``output``, e.g. a response,
+        and only returns the file name and content type. ``prepared`` can be the return value
+        of an earlier call to ``prepare`` for the same position.
+        """
+        with collect(self.event):
+            with span("generate"):
+                filename, passfile, material = prepared or self.prepare(order_position)
+                start = _tell(output)
+                write_signed_pass(passfile, material, output)
+            end = _tell(output)
+            record(
+                size=end - start if start is not None and end is not None else None,
+                assets=len(passfile._files),
             )
-            cafile.flush()
-
-            keyfile.write(order.event.settings.passbook_key)
-            keyfile.flush()
-            _pass = passfile.create(
-                certfile.name,
-                keyfile.name,
-                cafile.name,
-                order.event.settings.get("passbook_key_password", ""),
+        return filename, "application/vnd.apple.pkpass"
+
+    def prefetch_positions(self, positions: Iterable[OrderPosition]) -> List[OrderPosition]:
+        """
+        Loads the given positions of this event together with everything ``generate_pass`` needs,
+        using a number of queries that does not depend on the number of positions.
+        """
+        prefetch = (
+            "item__program_times",
+            Prefetch(
+                "item__meta_values",
+                queryset=ItemMetaValue.objects.select_related("property"),
+                to_attr="meta_values_cached",
+            ),
+        )
+        if isinstance(positions, QuerySet):
+            positions = list(
+                positions.select_related(*POSITION_SELECT_RELATED).prefetch_related(*prefetch)
             )
-
-        _pass.seek(0)
-        return filename, "application/vnd.apple.pkpass", _pass.read()
+        else:
+            positions = list(positions)
+            prefetch_related_objects(positions, *POSITION_SELECT_RELATED, *prefetch)
+        prefetch_related_objects([self.event], "item_meta_properties")
+
+        # Share our event object, so its settings and organizer are only loaded once
+        for op in positions:
+            op.order.event = self.event
+            op.item.event = self.event
+            if op.subevent:
+                op.subevent.event = self.event
+        return positions
+
+    def generate_batch(self, positions: Iterable[OrderPosition]) -> Iterator[Tuple[OrderPosition, Tuple[str, str, bytes]]]:
+        """
+        Generates the passes for many positions of this event at once. Yields tuples of the
+        position and the return value of ``generate``. The passes are not stored in the cache of
+        signed passes, which is only meant for single downloads.
+        """
+        for op in self.prefetch_positions(positions):
+            with language(op.order.locale, self.event.settings.region):
+                yield op, self.generate(op, cached=False)
+
+    def write_order(self, order: Order, output) -> Tuple[str, str]:
+        """
+        Writes a ``.pkpasses`` bundle with the passes of all tickets of an order to the file-like
+        ``output``, which Wallet imports in one step. Passes are added to the bundle one by one as
+        they are generated, and the event data they share is only loaded once. Returns the file
+        name and content type.
+        """
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as zipf:
+            for op, (filename, ttype, data) in self.generate_batch(self.get_tickets_to_print(order)):
+                # Passes are compressed archives themselves
+                zipf.writestr(
+                    _zip_info("{}-{}.pkpass".format(order.code, op.positionid), zipfile.ZIP_STORED),
+                    data,
+                )
+        return "{}-{}.pkpasses".format(order.event.slug, order.code), "application/vnd.apple.pkpasses"
+
+    def generate_order(self, order: Order) -> Tuple[str, str, bytes]:
+        """
+        Returns the bundle written by ``write_order``, or the pass itself for orders with a
+        single ticket.
+        """
+        positions = list(self.get_tickets_to_print(order))
+        if len(positions) == 1:
+            with language(order.locale, self.event.settings.region):
+                return self.generate(positions[0], cached=False)
+        output = BytesIO()
+        filename, ttype = self.write_order(order, output)
+        return filename, ttype, output.getvalue()
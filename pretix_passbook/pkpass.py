@@ -0,0 +1,175 @@
+import hashlib
+import json
+import struct
+import time
+import zipfile
+from collections import namedtuple
+from django.conf import settings as django_settings
+from io import BytesIO
+from wallet.models import Pass, PassHandler
+
+from pretix_passbook.assets import Asset, AssetCache
+from pretix_passbook.metrics import span
+from pretix_passbook.signing import (
+    REPRODUCIBLE, BaseSigner, SigningMaterial, get_signer,
+)
+
+
+class AssetArchive(namedtuple("AssetArchive", ("data", "directory", "count"))):
+    """
+    The images of a pass as ZIP entries: ``data`` holds the local file entries and ``directory``
+    the ``count`` matching records of the central directory. Passes with the same images are
+    written by splicing their ``pass.json``, manifest and signature in between, so the images
+    are not checksummed and copied into a new archive for every pass.
+    """
+
+    __slots__ = ()
+
+
+END_RECORD = struct.Struct("<4s4H2LH")
+# The earliest time a ZIP entry can have, used for all entries of reproducible passes
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class _OffsetBuffer(BytesIO):
+    """
+    A buffer that pretends to start at ``offset``, so ``zipfile`` records the positions its
+    entries will have after ``offset`` bytes of other entries.
+    """
+
+    def __init__(self, offset: int):
+        super().__init__()
+        self.offset = offset
+
+    def tell(self):
+        return super().tell() + self.offset
+
+    def seek(self, pos, whence=0):
+        return super().seek(pos - self.offset if whence == 0 else pos, whence) + self.offset
+
+
+def _zip_info(filename: str, compress_type: int) -> zipfile.ZipInfo:
+    zinfo = zipfile.ZipInfo(filename, ZIP_EPOCH if REPRODUCIBLE else time.localtime()[:6])
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = 0o600 << 16
+    return zinfo
+
+
+def _split_archive(data: bytes, offset: int = 0):
+    # Archives written by zipfile have no comment, so the end record is the last 22 bytes
+    _, _, _, _, count, size, start, _ = END_RECORD.unpack(data[-END_RECORD.size:])
+    start -= offset
+    return data[:start], data[start:start + size], count
+
+
+archive_cache = AssetCache(
+    django_settings.CONFIG_FILE.getint("passbook", "archive_cache_size", fallback=64) * 1024 * 1024,
+    name="asset_archive",
+)
+
+
+class PKPass(Pass):
+    """
+    A pass that is signed by one of our signers instead of the ``openssl`` call built into the
+    wallet library.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._digests = {}
+
+    def add_asset(self, name: str, asset: Asset):
+        self._files[name] = asset.data
+        self._digests[name] = asset.digest
+
+    def _createPassJson(self):
+        return json.dumps(self, default=PassHandler, sort_keys=REPRODUCIBLE).encode("utf-8")
+
+    def _createManifest(self, pass_json):
+        self._hashes["pass.json"] = hashlib.sha1(pass_json).hexdigest()
+        for filename, filedata in self._files.items():
+            self._hashes[filename] = (
+                self._digests.get(filename) or hashlib.sha1(filedata).hexdigest()
+            )
+        return json.dumps(self._hashes, sort_keys=REPRODUCIBLE).encode("utf-8")
+
+    def fingerprint(self, material: SigningMaterial) -> str:
+        """
+        A digest over everything that ends up in the signed pass: the pass.json payload, the
+        digests of all files and the signing material.
+        """
+        h = hashlib.sha256()
+        h.update(self._createPassJson())
+        for filename in sorted(self._files):
+            h.update(b"\0" + filename.encode())
+            h.update(
+                (self._digests.get(filename) or hashlib.sha1(self._files[filename]).hexdigest()).encode()
+            )
+        h.update(b"\0" + material.fingerprint.encode())
+        if REPRODUCIBLE:
+            h.update(b"\0reproducible")
+        return h.hexdigest()
+
+    def write(self, output, material: SigningMaterial, signer: BaseSigner = None):
+        """
+        Signs the pass and writes the archive to the file-like ``output``, which does not need
+        to be seekable. Images are already compressed, so only the other entries are deflated.
+        Only ``pass.json``, the manifest and the signature are added to the archive of the
+        images, which is shared by all passes with the same images.
+        """
+        signer = signer or get_signer()
+        with span("json"):
+            pass_json = self._createPassJson()
+            manifest = self._createManifest(pass_json)
+        with span("sign"):
+            signature = signer.sign(manifest, material)
+        with span("archive"):
+            self._write_archive(output, pass_json, manifest, signature)
+
+    def _asset_digests(self):
+        return tuple(
+            (filename, self._digests.get(filename) or hashlib.sha1(filedata).hexdigest())
+            for filename, filedata in self._files.items()
+        )
+
+    def _build_asset_archive(self) -> AssetArchive:
+        output = BytesIO()
+        files = sorted(self._files.items()) if REPRODUCIBLE else self._files.items()
+        with zipfile.ZipFile(output, "w") as zf:
+            for filename, filedata in files:
+                zf.writestr(
+                    _zip_info(filename, zipfile.ZIP_STORED if filename.endswith(".png") else zipfile.ZIP_DEFLATED),
+                    filedata,
+                )
+        return AssetArchive(*_split_archive(output.getvalue()))
+
+    def _write_archive(self, output, pass_json: bytes, manifest: bytes, signature: bytes):
+        archive = archive_cache.get(self._asset_digests(), self._build_asset_archive)
+        buffer = _OffsetBuffer(len(archive.data))
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr(_zip_info("pass.json", zipfile.ZIP_DEFLATED), pass_json)
+            zf.writestr(_zip_info("manifest.json", zipfile.ZIP_DEFLATED), manifest)
+            zf.writestr(_zip_info("signature", zipfile.ZIP_DEFLATED), signature)
+        data, directory, count = _split_archive(buffer.getvalue(), buffer.offset)
+
+        output.write(archive.data)
+        output.write(data)
+        output.write(archive.directory)
+        output.write(directory)
+        output.write(
+            END_RECORD.pack(
+                zipfile.stringEndArchive,
+                0,
+                0,
+                archive.count + count,
+                archive.count + count,
+                len(archive.directory) + len(directory),
+                len(archive.data) + len(data),
+                0,
+            )
+        )
+
+    def sign(self, material: SigningMaterial, signer: BaseSigner = None) -> bytes:
+        output = BytesIO()
+        self.write(output, material, signer)
+        return output.getvalue()
@@ -0,0 +1,87 @@
+from typing import List
+
+import logging
+import ssl
+from django.conf import settings as django_settings
+from django.utils.module_loading import import_string
+from functools import lru_cache
+from pretix.base.models import Event
+
+from pretix_passbook.models import Device
+from pretix_passbook.signing import get_signing_material
+
+logger = logging.getLogger(__name__)
+
+
+class BasePushSender:
+    """
+    A push sender notifies devices that a pass they registered for has changed. The devices
+    then ask the web service for the serial numbers of the changed passes.
+    """
+
+    def send(self, event: Event, push_tokens: List[str]):
+        raise NotImplementedError()  # NOQA
+
+
+class APNsPushSender(BasePushSender):
+    """
+    Sends push notifications through the Apple Push Notification service, authenticated with
+    the pass certificate of the event. Requires ``httpx`` with HTTP/2 support.
+    """
+
+    url = "https://api.push.apple.com/3/device/{}"
+
+    def _ssl_context(self, event: Event) -> ssl.SSLContext:
+        material = get_signing_material(event.settings)
+        context = ssl.create_default_context()
+        with material.paths() as (certfile, keyfile, cafile):
+            context.load_cert_chain(certfile, keyfile, password=material.key_password or None)
+        return context
+
+    def send(self, event: Event, push_tokens: List[str]):
+        import httpx
+
+        expired = []
+        with httpx.Client(http2=True, verify=self._ssl_context(event)) as client:
+            for token in push_tokens:
+                try:
+                    r = client.post(
+                        self.url.format(token),
+                        content=b"{}",
+                        headers={"apns-topic": event.settings.passbook_pass_type_id},
+                    )
+                except httpx.HTTPError:
+                    logger.exception("Could not send push notification")
+                    continue
+                if r.status_code == 410:
+                    expired.append(token)
+                elif r.status_code != 200:
+                    logger.warning("APNs rejected push notification: %s %s", r.status_code, r.text)
+        if expired:
+            Device.objects.filter(push_token__in=expired).delete()
+
+
+class LocalPushSender(BasePushSender):
+    """
+    Records push notifications instead of sending them, for development and tests.
+    """
+
+    sent = []
+
+    def send(self, event: Event, push_tokens: List[str]):
+        for token in push_tokens:
+            self.sent.append((event.pk, token))
+            logger.info("Push notification for %s", token)
+
+
+@lru_cache(maxsize=None)
+def get_push_sender() -> BasePushSender:
+    """
+    Returns the push sender configured in the ``push_sender`` option of the ``[passbook]``
+    section of the pretix configuration file as a dotted path.
+    """
+    return import_string(
+        django_settings.CONFIG_FILE.get(
+            "passbook", "push_sender", fallback="pretix_passbook.push.APNsPushSender"
+        )
+    )()
@@ -0,0 +1,159 @@
+from typing import Optional, Tuple
+
+from dataclasses import dataclass
+from wallet.models import Barcode, BarcodeFormat, EventTicket, Location
+
+from pretix_passbook.i18n import get_labels
+from pretix_passbook.metrics import span
+from pretix_passbook.pkpass import PKPass
+from pretix_passbook.template import PassTemplate
+
+
+@dataclass
+class PassData:
+    """
+    Everything in a pass that is specific to one ticket, taken from the database by
+    ``PassbookOutput.pass_data``. Dates are already formatted in the language of the order,
+    ``locale``, so passes can be rendered from these objects and the template of their event
+    without access to the database, e.g. in another process.
+    """
+
+    __slots__ = (
+        "event_id",
+        "subevent_id",
+        "item_id",
+        "variation_id",
+        "locale",
+        "serial_number",
+        "authentication_token",
+        "secret",
+        "order_code",
+        "email",
+        "purchase_date",
+        "attendee_name",
+        "seated",
+        "seat",
+        "program_times",
+        "valid_from",
+        "valid_until",
+        "relevant_date",
+        "expiration_date",
+        "voided",
+    )
+
+    event_id: int
+    subevent_id: Optional[int]
+    item_id: int
+    variation_id: Optional[int]
+    locale: str
+    serial_number: str
+    authentication_token: str
+    secret: str
+    order_code: str
+    email: Optional[str]
+    purchase_date: str
+    attendee_name: Optional[str]
+    seated: bool
+    seat: Optional[str]
+    program_times: Optional[Tuple[str, str]]
+    valid_from: Optional[str]
+    valid_until: Optional[str]
+    relevant_date: Optional[str]
+    expiration_date: Optional[str]
+    voided: bool
+
+
+def render_pass(data: PassData, template: PassTemplate) -> PKPass:
+    """
+    Builds the pass of a ticket from its data and the template of its event or date, which must
+    contain the fragment of its product. This does not touch the database, but labels are
+    translated to the active language, which should be ``data.locale``.
+    """
+    labels = get_labels()
+    item = template.items[data.item_id, data.variation_id]
+    card = EventTicket()
+    for key, value, label in template.header_fields:
+        card.addHeaderField(key, value, label)
+
+    # Ticket content
+
+    card.addPrimaryField("eventName", template.event_name, labels["event"])
+    card.addSecondaryField("ticket", item.product, labels["product"])
+
+    if data.seated:
+        card.addAuxiliaryField("seat", data.seat or labels["general_admission"], labels["seat"])
+    elif data.attendee_name:
+        card.addAuxiliaryField("name", data.attendee_name, labels["attendee_name"])
+
+    if template.admission:
+        card.addBackField("doorsAdmission", template.admission, labels["admission_time"])
+
+    # Seated tickets have no space left for the end of the ticket validity on the front
+    add_doors_close = card.addBackField if data.seated else card.addAuxiliaryField
+    if data.program_times:
+        start, end = data.program_times
+        card.addAuxiliaryField("doorsOpen", start, labels["from"])
+        add_doors_close("doorsClose", end, labels["to"])
+    else:
+        card.addAuxiliaryField("doorsOpen", data.valid_from or template.date_from_display, labels["from"])
+        if data.valid_until or template.date_to_display:
+            add_doors_close("doorsClose", data.valid_until or template.date_to_display, labels["to"])
+
+    if data.attendee_name:
+        card.addBackField("name", data.attendee_name, labels["attendee_name"])
+
+    if data.email:
+        card.addBackField("email", data.email, labels["ordered_by"])
+    card.addBackField("organizer", template.organizer_name, labels["organizer"])
+    if template.contact_mail:
+        card.addBackField("organizerContact", template.contact_mail, labels["organizer_contact"])
+    card.addBackField("orderCode", data.order_code, labels["order_code"])
+    card.addBackField("purchaseDate", data.purchase_date, labels["purchase_date"])
+    card.addBackField("website", template.website, labels["website"])
+
+    if item.backfield:
+        card.addBackField("metabackfield", item.backfield, labels["additional_information"])
+
+    passfile = PKPass(
+        card,
+        passTypeIdentifier=template.pass_type_id,
+        organizationName=template.event_name,
+        teamIdentifier=template.team_id,
+    )
+
+    passfile.serialNumber = data.serial_number
+    if template.webservice_url:
+        passfile.webServiceURL = template.webservice_url
+        passfile.authenticationToken = data.authentication_token
+    if template.webservice and data.voided:
+        passfile.voided = True
+
+    passfile.description = labels["description"].format(
+        event=template.event_name, product=item.product
+    )
+    passfile.barcode = Barcode(message=data.secret, format=BarcodeFormat.QR)
+    passfile.barcode.altText = data.secret
+
+    # note: exprirationDate is a typo in the underlying wallet-library
+    if data.relevant_date or data.expiration_date:
+        passfile.relevantDate = data.relevant_date
+        passfile.exprirationDate = data.expiration_date
+    elif template.expiration_date:
+        passfile.exprirationDate = template.expiration_date
+    else:
+        passfile.relevantDate = template.relevant_date
+
+    if template.location:
+        passfile.locations = [Location(*template.location)]
+
+    with span("assets"):
+        for filename, asset in template.files:
+            passfile.add_asset(filename, asset)
+        passfile.logoText = template.logo_text
+        if item.thumbnail:
+            passfile.add_asset("thumbnail.png", item.thumbnail)
+
+    passfile.backgroundColor = template.background_color
+    passfile.foregroundColor = template.foreground_color
+    passfile.labelColor = template.label_color
+    return passfile
@@ -1,12 +1,35 @@
 from collections import OrderedDict
+from datetime import timedelta
 from django import forms
+from django.conf import settings
 from django.core.files import File
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils.html import format_html
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
-from pretix.base.settings import settings_hierarkey
-from pretix.base.signals import register_global_settings, register_ticket_outputs
+from django_scopes import scopes_disabled
+from pretix.base.models import (
+    Event, Event_SettingsStore, Item, ItemMetaProperty, ItemMetaValue,
+    ItemVariation, Organizer, Organizer_SettingsStore, Seat, SubEvent,
+)
+from pretix.base.settings import (
+    GlobalSettingsObject_SettingsStore, settings_hierarkey,
+)
+from pretix.base.signals import (
+    order_canceled, order_changed, order_modified, order_paid,
+    order_reactivated, periodic_task, register_data_exporters,
+    register_global_settings, register_ticket_outputs,
+)
+from pretix.helpers.periodic import minimum_interval
+from pretix.multidomain.models import KnownDomain
+from pretix.multidomain.urlreverse import eventreverse
+from pretix.presale.signals import order_info
 
-from .forms import CertificateFileField, validate_rsa_privkey
+from .forms import (
+    CertificateFileField, save_derived_variants, validate_rsa_privkey,
+)
 
 
 @receiver(register_ticket_outputs, dispatch_uid="output_passbook")
@@ -16,6 +39,202 @@ def register_ticket_output(sender, **kwargs):
     return PassbookOutput
 
 
+@receiver(register_data_exporters, dispatch_uid="dataexport_passbook")
+def register_data_exporter(sender, **kwargs):
+    from .exporters import AllPassesExporter
+
+    return AllPassesExporter
+
+
+@receiver(order_paid, dispatch_uid="passbook_order_paid")
+@receiver(order_changed, dispatch_uid="passbook_order_changed")
+@receiver(order_modified, dispatch_uid="passbook_order_modified")
+@receiver(order_canceled, dispatch_uid="passbook_order_canceled")
+@receiver(order_reactivated, dispatch_uid="passbook_order_reactivated")
+def order_updated(sender, order, **kwargs):
+    from .models import IssuedPass
+    from .webservice import mark_passes_updated
+
+    mark_passes_updated(
+        sender, IssuedPass.objects.filter(order_position__order=order)
+    )
+
+
+@receiver(order_info, dispatch_uid="passbook_order_bundle")
+def order_bundle_button(sender, order, request, **kwargs):
+    from .passbook import PassbookOutput
+
+    output = PassbookOutput(sender)
+    # Orders with a single ticket only need its own download button
+    if not output.is_enabled or not order.ticket_download_available or len(list(output.get_tickets_to_print(order))) < 2:
+        return ""
+    return format_html(
+        '<p><a href="{}" class="btn btn-default"><span class="fa fa-mobile" aria-hidden="true"></span> {}</a></p>',
+        eventreverse(sender, "plugins:pretix_passbook:order.bundle", kwargs={"order": order.code, "secret": order.secret}),
+        _("Add all tickets to Wallet"),
+    )
+
+
+@receiver(order_paid, dispatch_uid="passbook_order_paid_pregenerate")
+@receiver(order_changed, dispatch_uid="passbook_order_changed_pregenerate")
+def order_pregenerate(sender, order, **kwargs):
+    from .tasks import PREGENERATE_DELAY, pregenerate_passes
+
+    # Without a task runner, the passes would be generated within the request of the customer
+    if not settings.HAS_CELERY or not sender.settings.get("ticketoutput_passbook_pregenerate", as_type=bool):
+        return
+    transaction.on_commit(
+        lambda: pregenerate_passes.apply_async(
+            kwargs={"event": sender.pk, "order": order.pk}, countdown=PREGENERATE_DELAY
+        )
+    )
+
+
+@receiver(post_save, sender=Event_SettingsStore, dispatch_uid="passbook_event_settings_saved")
+@receiver(post_delete, sender=Event_SettingsStore, dispatch_uid="passbook_event_settings_deleted")
+@receiver(post_save, sender=SubEvent, dispatch_uid="passbook_subevent_saved")
+@receiver(post_delete, sender=SubEvent, dispatch_uid="passbook_subevent_deleted")
+def event_changed(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import affects_passes, mark_dependent_passes
+
+    if sender is Event_SettingsStore:
+        invalidate_templates(event_id=instance.object_id)
+        if affects_passes(instance.key):
+            mark_dependent_passes(event_id=instance.object_id)
+    else:
+        invalidate_templates(subevent_id=instance.pk)
+        mark_dependent_passes(subevent_id=instance.pk)
+
+
+@receiver(post_save, sender=Event_SettingsStore, dispatch_uid="passbook_event_image_saved")
+def event_image_saved(sender, instance, **kwargs):
+    if instance.key.startswith("ticketoutput_passbook_") and instance.value.startswith("file://"):
+        save_derived_variants(instance.value[7:])
+
+
+@receiver(post_save, sender=Item, dispatch_uid="passbook_item_saved")
+@receiver(post_delete, sender=Item, dispatch_uid="passbook_item_deleted")
+@receiver(post_save, sender=ItemMetaProperty, dispatch_uid="passbook_item_meta_property_saved")
+@receiver(post_delete, sender=ItemMetaProperty, dispatch_uid="passbook_item_meta_property_deleted")
+def item_changed(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import mark_dependent_passes
+
+    invalidate_templates(event_id=instance.event_id)
+    if sender is Item:
+        mark_dependent_passes(item_id=instance.pk)
+    else:
+        # The default value of a property applies to all products
+        mark_dependent_passes(event_id=instance.event_id)
+
+
+@receiver(post_save, sender=ItemVariation, dispatch_uid="passbook_item_variation_saved")
+@receiver(post_delete, sender=ItemVariation, dispatch_uid="passbook_item_variation_deleted")
+@receiver(post_save, sender=ItemMetaValue, dispatch_uid="passbook_item_meta_value_saved")
+@receiver(post_delete, sender=ItemMetaValue, dispatch_uid="passbook_item_meta_value_deleted")
+def item_data_changed(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import mark_dependent_passes
+
+    invalidate_templates(event_id=instance.item.event_id)
+    if sender is ItemVariation:
+        mark_dependent_passes(variation_id=instance.pk)
+    else:
+        mark_dependent_passes(item_id=instance.item_id)
+
+
+@receiver(post_save, sender=Seat, dispatch_uid="passbook_seat_saved")
+def seat_changed(sender, instance, **kwargs):
+    from .webservice import mark_dependent_passes
+
+    mark_dependent_passes(seat_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Seat, dispatch_uid="passbook_seat_deleted")
+def seat_deleted(sender, instance, **kwargs):
+    from .models import IssuedPass
+    from .webservice import mark_dependent_passes
+
+    # The seat is removed from the passes before they are marked
+    with scopes_disabled():
+        issued_passes = tuple(IssuedPass.objects.filter(seat_id=instance.pk).values_list("pk", flat=True))
+    if issued_passes:
+        mark_dependent_passes(pk__in=issued_passes)
+
+
+@receiver(post_save, sender=Event, dispatch_uid="passbook_event_saved")
+def event_saved(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import mark_dependent_passes
+
+    invalidate_templates(event_id=instance.pk)
+    mark_dependent_passes(event_id=instance.pk)
+
+
+@receiver(post_save, sender=Organizer_SettingsStore, dispatch_uid="passbook_organizer_settings_saved")
+@receiver(post_delete, sender=Organizer_SettingsStore, dispatch_uid="passbook_organizer_settings_deleted")
+@receiver(post_save, sender=Organizer, dispatch_uid="passbook_organizer_saved")
+def organizer_changed(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import affects_passes, mark_dependent_passes
+
+    organizer_id = instance.pk if sender is Organizer else instance.object_id
+    invalidate_templates(organizer_id=organizer_id)
+    if sender is Organizer or affects_passes(instance.key):
+        mark_dependent_passes(event__organizer_id=organizer_id)
+
+
+@receiver(post_save, sender=KnownDomain, dispatch_uid="passbook_domain_saved")
+@receiver(post_delete, sender=KnownDomain, dispatch_uid="passbook_domain_deleted")
+def domain_changed(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import mark_dependent_passes
+
+    if instance.event_id:
+        invalidate_templates(event_id=instance.event_id)
+        mark_dependent_passes(event_id=instance.event_id)
+    else:
+        invalidate_templates(organizer_id=instance.organizer_id)
+        mark_dependent_passes(event__organizer_id=instance.organizer_id)
+
+
+@receiver(post_save, sender=GlobalSettingsObject_SettingsStore, dispatch_uid="passbook_global_settings_saved")
+@receiver(post_delete, sender=GlobalSettingsObject_SettingsStore, dispatch_uid="passbook_global_settings_deleted")
+def global_settings_changed(sender, instance, **kwargs):
+    from .template import invalidate_templates
+    from .webservice import affects_passes, mark_dependent_passes
+
+    invalidate_templates()
+    if affects_passes(instance.key):
+        mark_dependent_passes()
+
+
+@receiver(periodic_task, dispatch_uid="passbook_geocode")
+@minimum_interval(minutes_after_success=60, minutes_after_error=60)
+def geocode_venues(sender, **kwargs):
+    from .geocoding import (
+        event_addresses, geocode_addresses, get_geocoder, upcoming_events,
+    )
+
+    if get_geocoder() is None:
+        return
+    with scopes_disabled():
+        addresses = set()
+        for event in upcoming_events():
+            addresses.update(event_addresses(event, upcoming=True))
+        geocode_addresses(addresses)
+
+
+@receiver(periodic_task, dispatch_uid="passbook_dates_changed")
+@minimum_interval(minutes_after_success=5)
+def dates_changed(sender, **kwargs):
+    from .webservice import mark_changed_dates
+
+    with scopes_disabled():
+        mark_changed_dates(now() - timedelta(days=1))
+
+
 @receiver(register_global_settings, dispatch_uid="passbook_settings")
 def register_global_settings(sender, **kwargs):
     return OrderedDict(
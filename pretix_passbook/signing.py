@@ -0,0 +1,342 @@
+from typing import List
+
+import atexit
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.serialization import pkcs7
+from django.conf import settings as django_settings
+from django.core.files import File
+from django.utils.module_loading import import_string
+from functools import cached_property, lru_cache
+
+from pretix_passbook.metrics import count
+
+SIGNING_SETTINGS = (
+    "passbook_certificate_file",
+    "passbook_wwdr_certificate_file",
+    "passbook_key",
+    "passbook_key_password",
+)
+MAX_CACHED_MATERIALS = 16
+REPRODUCIBLE = django_settings.CONFIG_FILE.getboolean("passbook", "reproducible", fallback=False)
+
+_materials = OrderedDict()
+_materials_lock = threading.Lock()
+
+
+class SigningMaterial:
+    """
+    The parsed certificate, CA chain and decrypted private key used to sign passes. Instances
+    are shared between requests of the same worker, so they must be treated as read-only. The
+    key is only decrypted once a signer in this process uses it.
+    """
+
+    def __init__(self, fingerprint: str, certificate_pem: bytes, chain_pem: bytes, key_pem: bytes, key_password: str):
+        self.fingerprint = fingerprint
+        self.certificate_pem = certificate_pem
+        self.chain_pem = chain_pem
+        self.key_pem = key_pem
+        self.key_password = key_password or ""
+        self.certificate = x509.load_pem_x509_certificate(certificate_pem)
+        self.chain = x509.load_pem_x509_certificates(chain_pem)
+        self._paths = None
+        self._paths_lock = threading.Lock()
+        self._users = 0
+        self._closed = False
+
+    @cached_property
+    def private_key(self):
+        return serialization.load_pem_private_key(
+            self.key_pem, password=self.key_password.encode() if self.key_password else None
+        )
+
+    @cached_property
+    def digest(self) -> str:
+        return material_digest(**self.export())
+
+    def export(self) -> dict:
+        """
+        The raw material as keyword arguments for ``SigningMaterial``, for signers in other
+        processes.
+        """
+        return {
+            "certificate_pem": self.certificate_pem,
+            "chain_pem": self.chain_pem,
+            "key_pem": self.key_pem,
+            "key_password": self.key_password,
+        }
+
+    @contextmanager
+    def paths(self):
+        """
+        Yields ``(certificate, key, chain)`` file paths for signers that can only read from files.
+        The files are written once. When the material is evicted from the cache, they are only
+        removed after the last signer still using them is done.
+        """
+        with self._paths_lock:
+            if self._paths is None:
+                self._paths = tuple(
+                    _write_private_file(content)
+                    for content in (self.certificate_pem, self.key_pem, self.chain_pem)
+                )
+            self._users += 1
+            paths = self._paths
+        try:
+            yield paths
+        finally:
+            with self._paths_lock:
+                self._users -= 1
+                if self._closed and not self._users:
+                    self._remove_files()
+
+    def _remove_files(self):
+        for path in self._paths or ():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._paths = None
+
+    def close(self):
+        with self._paths_lock:
+            self._closed = True
+            if not self._users:
+                self._remove_files()
+
+
+def _write_private_file(content: bytes) -> str:
+    fd, path = tempfile.mkstemp(prefix="pretix-passbook-", suffix=".pem")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    return path
+
+
+def _read_file_setting(settings, key: str) -> bytes:
+    f = settings.get(key, as_type=File, binary_file=True)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def material_digest(certificate_pem: bytes, chain_pem: bytes, key_pem: bytes, key_password: str) -> str:
+    """
+    Digest of the content of signing material. Signers in other processes store material under
+    its digest, which they compute themselves, so senders cannot replace the material of others.
+    """
+    h = hashlib.sha256()
+    for part in (certificate_pem, chain_pem, key_pem, (key_password or "").encode()):
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+def signing_fingerprint(settings) -> str:
+    """
+    Fingerprint of the raw signing settings of an event. File settings are stored by their
+    storage name, so uploading a new certificate results in a new fingerprint.
+    """
+    h = hashlib.sha256()
+    for key in SIGNING_SETTINGS:
+        h.update((settings.get(key, as_type=str) or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def cached_signing_material(fingerprint: str, load=None) -> SigningMaterial:
+    """
+    Returns the signing material with the given fingerprint that has been used in this process
+    before. Otherwise, it is created by calling ``load``, or ``None`` is returned without it.
+    """
+    with _materials_lock:
+        material = _materials.get(fingerprint)
+        if material is not None:
+            _materials.move_to_end(fingerprint)
+            count("signing_material", "hit")
+            return material
+    if load is None:
+        return None
+
+    count("signing_material", "miss")
+    material = load()
+
+    with _materials_lock:
+        material = _materials.setdefault(fingerprint, material)
+        while len(_materials) > MAX_CACHED_MATERIALS:
+            _, evicted = _materials.popitem(last=False)
+            evicted.close()
+    return material
+
+
+def get_signing_material(settings) -> SigningMaterial:
+    """
+    Returns the signing material for the given settings object, loading it from storage only if
+    the signing settings changed since it was last used in this process.
+    """
+    fingerprint = signing_fingerprint(settings)
+    return cached_signing_material(
+        fingerprint,
+        lambda: SigningMaterial(
+            fingerprint,
+            certificate_pem=_read_file_setting(settings, "passbook_certificate_file"),
+            chain_pem=_read_file_setting(settings, "passbook_wwdr_certificate_file"),
+            key_pem=settings.passbook_key.encode(),
+            key_password=settings.get("passbook_key_password", ""),
+        ),
+    )
+
+
+class BaseSigner:
+    """
+    A signer creates the detached PKCS#7 signature over a pass manifest and converts uploaded
+    certificates into PEM format.
+    """
+
+    identifier = None
+    requires_openssl = False
+
+    def sign(self, manifest: bytes, material: SigningMaterial) -> bytes:
+        raise NotImplementedError()  # NOQA
+
+    def sign_many(self, manifests: List[bytes], material: SigningMaterial) -> List[bytes]:
+        """
+        Signs a number of manifests with the same material. Signers that pay a fixed cost per
+        call, e.g. a round trip to another process, can do this in one go.
+        """
+        return [self.sign(manifest, material) for manifest in manifests]
+
+    def der_to_pem(self, content: bytes) -> bytes:
+        """
+        Converts a DER encoded certificate to PEM. Raises ``ValueError`` if the content is not a
+        valid certificate.
+        """
+        raise NotImplementedError()  # NOQA
+
+
+class NativeSigner(BaseSigner):
+    """
+    Signs passes in memory using the loaded key objects, without spawning any processes. If
+    passes are built reproducibly, the signature has no signed attributes, since those include
+    the signing time.
+    """
+
+    identifier = "native"
+
+    def sign(self, manifest: bytes, material: SigningMaterial) -> bytes:
+        builder = (
+            pkcs7.PKCS7SignatureBuilder()
+            .set_data(manifest)
+            .add_signer(material.certificate, material.private_key, hashes.SHA256())
+        )
+        for certificate in material.chain:
+            builder = builder.add_certificate(certificate)
+        options = [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.Binary]
+        if REPRODUCIBLE:
+            options.append(pkcs7.PKCS7Options.NoAttributes)
+        return builder.sign(serialization.Encoding.DER, options)
+
+    def der_to_pem(self, content: bytes) -> bytes:
+        return x509.load_der_x509_certificate(content).public_bytes(
+            serialization.Encoding.PEM
+        )
+
+
+class OpenSSLSigner(BaseSigner):
+    """
+    Signs passes by calling the ``openssl`` binary, as the wallet library does.
+    """
+
+    identifier = "openssl"
+    requires_openssl = True
+
+    def _run(self, cmd, stdin: bytes) -> bytes:
+        process = subprocess.Popen(
+            cmd,
+            stderr=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+        )
+        out, error = process.communicate(stdin)
+        if process.returncode != 0:
+            raise ValueError(error)
+        return out
+
+    def sign(self, manifest: bytes, material: SigningMaterial) -> bytes:
+        with material.paths() as (certfile, keyfile, cafile):
+            return self._run(
+                [
+                    "openssl",
+                    "smime",
+                    "-binary",
+                    "-sign",
+                    "-certfile",
+                    cafile,
+                    "-signer",
+                    certfile,
+                    "-inkey",
+                    keyfile,
+                    "-outform",
+                    "DER",
+                    "-passin",
+                    "pass:{}".format(material.key_password),
+                    *(["-noattr"] if REPRODUCIBLE else []),
+                ],
+                manifest,
+            )
+
+    def der_to_pem(self, content: bytes) -> bytes:
+        return self._run(
+            ["openssl", "x509", "-inform", "DER", "-outform", "PEM"], content
+        )
+
+
+SIGNERS = {
+    NativeSigner.identifier: NativeSigner,
+    OpenSSLSigner.identifier: OpenSSLSigner,
+    "pool": "pretix_passbook.signserver.PoolSigner",
+    "remote": "pretix_passbook.signserver.RemoteSigner",
+}
+
+
+@lru_cache(maxsize=None)
+def get_signing_executor() -> ThreadPoolExecutor:
+    """
+    The thread pool asynchronous pass generation signs passes in. Its size is set with the
+    ``signing_threads`` option of the ``[passbook]`` section of the pretix configuration file.
+    """
+    return ThreadPoolExecutor(
+        max_workers=django_settings.CONFIG_FILE.getint(
+            "passbook", "signing_threads", fallback=os.cpu_count() or 1
+        ),
+        thread_name_prefix="pretix-passbook-signing",
+    )
+
+
+@lru_cache(maxsize=None)
+def get_signer(identifier: str = None) -> BaseSigner:
+    """
+    Returns the signer with the given identifier, or the one configured in the ``signer`` option
+    of the ``[passbook]`` section of the pretix configuration file. Instead of an identifier,
+    the dotted path of a ``BaseSigner`` subclass can be used.
+    """
+    if identifier is None:
+        identifier = django_settings.CONFIG_FILE.get("passbook", "signer", fallback="native")
+    signer = SIGNERS.get(identifier, identifier)
+    if isinstance(signer, str):
+        signer = import_string(signer)
+    return signer()
+
+
+@atexit.register
+def clear_signing_materials():
+    with _materials_lock:
+        while _materials:
+            _, material = _materials.popitem()
+            material.close()
@@ -0,0 +1,350 @@
+from typing import List, Optional
+
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from django.conf import settings as django_settings
+
+from pretix_passbook.signing import (
+    BaseSigner, NativeSigner, SigningMaterial, cached_signing_material,
+    material_digest,
+)
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct(">L")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def _config(option: str, fallback: int) -> int:
+    return django_settings.CONFIG_FILE.getint("passbook", option, fallback=fallback)
+
+
+def handle_request(request: dict) -> dict:
+    """
+    Signs the ``manifests`` of a request with the material with the digest ``material``, see
+    ``material_digest``. The raw material only needs to be part of the request if the response
+    asked for it with ``missing``, because it is kept in memory afterwards.
+    """
+    digest = request["material"]
+    if "key_pem" in request:
+        raw = {key: request[key] for key in ("certificate_pem", "chain_pem", "key_pem", "key_password")}
+        if material_digest(**raw) != digest:
+            return {"error": "The signing material does not match its digest"}
+        material = cached_signing_material(digest, lambda: SigningMaterial(digest, **raw))
+    else:
+        material = cached_signing_material(digest)
+        if material is None:
+            return {"missing": True}
+
+    try:
+        return {"signatures": NativeSigner().sign_many(request["manifests"], material)}
+    except Exception as e:
+        logger.exception("Could not sign passes")
+        return {"error": str(e)}
+
+
+def _encode_bytes(obj):
+    if isinstance(obj, bytes):
+        return {"$bytes": base64.b64encode(obj).decode()}
+    raise TypeError(type(obj))
+
+
+def _decode_bytes(obj: dict):
+    if obj.keys() == {"$bytes"}:
+        return base64.b64decode(obj["$bytes"])
+    return obj
+
+
+def write_frame(f, message: dict):
+    payload = json.dumps(message, default=_encode_bytes).encode()
+    f.write(FRAME_HEADER.pack(len(payload)) + payload)
+    f.flush()
+
+
+def read_frame(f) -> Optional[dict]:
+    """
+    Reads a message written by ``write_frame``. Returns ``None`` if the connection was closed
+    before a new message started.
+    """
+    header = f.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError()
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError("Frame too large")
+    payload = f.read(size)
+    if len(payload) < size:
+        raise EOFError()
+    return json.loads(payload, object_hook=_decode_bytes)
+
+
+def parse_address(address: str):
+    """
+    Turns ``unix:/path/to/socket`` or ``host:port`` into a socket family and address.
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET6 if ":" in host else socket.AF_INET, (host.strip("[]"), int(port))
+
+
+class SigningRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = read_frame(self.rfile)
+            except (EOFError, ValueError):
+                return
+            if request is None:
+                return
+            write_frame(self.wfile, handle_request(request))
+
+
+class SigningServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Signs passes for ``RemoteSigner`` clients, handling every connection in its own thread. The
+    protocol is not authenticated, so the server should only listen on a Unix socket, which only
+    its own user can connect to, or an interface that is not reachable from untrusted networks.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: str):
+        self.address_family, server_address = parse_address(address)
+        if self.address_family == socket.AF_UNIX and os.path.exists(server_address):
+            os.unlink(server_address)
+        super().__init__(server_address, SigningRequestHandler)
+
+    def server_bind(self):
+        if self.address_family != socket.AF_UNIX:
+            return super().server_bind()
+        # Only the user running the server may connect, from the moment the socket exists
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if self.address_family == socket.AF_UNIX:
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+
+class RemoteSigner(BaseSigner):
+    """
+    Has passes signed by a ``SigningServer`` at the address configured in the
+    ``signer_address`` option, e.g. ``unix:/run/pretix/passbook.sock``. Up to
+    ``signer_connections`` connections are kept open and reused. The key is sent to the server
+    once, when the server does not know it yet, and never decrypted in this process.
+    """
+
+    identifier = "remote"
+
+    def __init__(self, address: str = None, connections: int = None, timeout: float = None):
+        config = django_settings.CONFIG_FILE
+        self.address = address or config.get("passbook", "signer_address")
+        self.timeout = timeout or config.getfloat("passbook", "signer_timeout", fallback=10.0)
+        self._slots = threading.BoundedSemaphore(connections or _config("signer_connections", 8))
+        self._idle = queue.LifoQueue()
+
+    def _connect(self) -> socket.socket:
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    @contextmanager
+    def _connection(self, fresh: bool = False):
+        with self._slots:
+            connection = None
+            if not fresh:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+            if connection is None:
+                sock = self._connect()
+                connection = sock, sock.makefile("rwb")
+            try:
+                yield connection[1]
+            except BaseException:
+                for c in reversed(connection):
+                    c.close()
+                raise
+            self._idle.put(connection)
+
+    def _call(self, f, request: dict) -> dict:
+        write_frame(f, request)
+        response = read_frame(f)
+        if response is None:
+            raise EOFError()
+        return response
+
+    def sign_many(self, manifests: List[bytes], material: SigningMaterial) -> List[bytes]:
+        request = {"material": material.digest, "manifests": manifests}
+        for attempt in range(2):
+            try:
+                # An idle connection might have been closed by the server in the meantime, so
+                # the request is repeated once on a new connection
+                with self._connection(fresh=attempt > 0) as f:
+                    response = self._call(f, request)
+                    if response.get("missing"):
+                        response = self._call(f, dict(request, **material.export()))
+                break
+            except (EOFError, ConnectionError):
+                if attempt:
+                    raise
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["signatures"]
+
+    def sign(self, manifest: bytes, material: SigningMaterial) -> bytes:
+        return self.sign_many([manifest], material)[0]
+
+    def der_to_pem(self, content: bytes) -> bytes:
+        return NativeSigner().der_to_pem(content)
+
+
+class PoolSigner(BaseSigner):
+    """
+    Signs passes in ``signing_processes`` long-lived processes that are started on first use.
+    Each process keeps the keys it has been sent in memory. Signatures requested while all
+    processes are busy are queued and sent to the next free process in batches of up to
+    ``signing_batch_size``. A process that fails or does not answer within ``signer_timeout``
+    seconds is replaced.
+    """
+
+    identifier = "pool"
+
+    def __init__(self, processes: int = None, batch_size: int = None, timeout: float = None):
+        self.processes = processes or _config("signing_processes", os.cpu_count() or 1)
+        self.batch_size = batch_size or _config("signing_batch_size", 32)
+        self.timeout = timeout or django_settings.CONFIG_FILE.getfloat("passbook", "signer_timeout", fallback=10.0)
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            # Threads do not survive a fork, so a forked process starts its own processes
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            for i in range(self.processes):
+                threading.Thread(
+                    target=self._dispatch, daemon=True, name="pretix-passbook-signer-{}".format(i)
+                ).start()
+            self._pid = os.getpid()
+
+    def _spawn(self):
+        from pretix_passbook.workers import serve_signer
+
+        context = multiprocessing.get_context("spawn")
+        connection, child_connection = context.Pipe()
+        process = context.Process(
+            target=serve_signer, args=(child_connection,), daemon=True
+        )
+        process.start()
+        child_connection.close()
+        return connection, process
+
+    def _take(self) -> list:
+        jobs = [self._queue.get()]
+        while len(jobs) < self.batch_size:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _call(self, connection, request: dict) -> dict:
+        connection.send(request)
+        if not connection.poll(self.timeout):
+            raise TimeoutError("Signing process did not respond")
+        return connection.recv()
+
+    def _dispatch(self):
+        connection = process = None
+        known = set()
+        while True:
+            batches = OrderedDict()
+            for manifest, material, future in self._take():
+                # Jobs that are no longer waited for are not signed
+                if future.set_running_or_notify_cancel():
+                    batches.setdefault(material.digest, (material, []))[1].append((manifest, future))
+
+            for digest, (material, jobs) in batches.items():
+                request = {"material": digest, "manifests": [manifest for manifest, future in jobs]}
+                try:
+                    if connection is None:
+                        connection, process = self._spawn()
+                        known = set()
+                    if digest not in known:
+                        request.update(material.export())
+                    response = self._call(connection, request)
+                    if response.get("missing"):
+                        response = self._call(connection, dict(request, **material.export()))
+                    known.add(digest)
+                    if "error" in response:
+                        results = [ValueError(response["error"])] * len(jobs)
+                    else:
+                        results = response["signatures"]
+                        if len(results) != len(jobs):
+                            raise ValueError("Signing process returned {} signatures for {} manifests".format(len(results), len(jobs)))
+                except Exception as e:
+                    # The process is in an unknown state, so it is replaced for the next batch
+                    logger.exception("Signing process failed")
+                    if process is not None:
+                        process.kill()
+                        connection.close()
+                    connection = process = None
+                    results = [e] * len(jobs)
+
+                for (manifest, future), result in zip(jobs, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    def sign_many(self, manifests: List[bytes], material: SigningMaterial) -> List[bytes]:
+        self._start()
+        futures = []
+        for manifest in manifests:
+            futures.append(Future())
+            self._queue.put((manifest, material, futures[-1]))
+        try:
+            return [future.result(timeout=self.timeout) for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def sign(self, manifest: bytes, material: SigningMaterial) -> bytes:
+        return self.sign_many([manifest], material)[0]
+
+    def der_to_pem(self, content: bytes) -> bytes:
+        return NativeSigner().der_to_pem(content)
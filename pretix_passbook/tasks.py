@@ -0,0 +1,61 @@
+from typing import List
+
+import os
+from django.conf import settings as django_settings
+from django.core.files.base import ContentFile
+from pretix.base.models import CachedTicket, Event, Order
+from pretix.base.services.tasks import EventTask
+from pretix.celery_app import app
+
+from pretix_passbook.models import Registration
+from pretix_passbook.push import get_push_sender
+
+# Seconds to wait after an order was paid or changed, so pretix has discarded the tickets it
+# cached before the change by the time passes are generated
+PREGENERATE_DELAY = 10
+
+
+@app.task(base=EventTask)
+def send_pushes(event: Event, issued_passes: List[int]):
+    tokens = set(
+        Registration.objects.filter(issued_pass__in=issued_passes).values_list(
+            "device__push_token", flat=True
+        )
+    )
+    if tokens:
+        get_push_sender().send(event, sorted(tokens))
+
+
+@app.task(
+    base=EventTask,
+    rate_limit=django_settings.CONFIG_FILE.get("passbook", "pregenerate_rate_limit", fallback="60/m"),
+)
+def pregenerate_passes(event: Event, order: int):
+    """
+    Generates the passes of all tickets in a paid order that are not cached yet and stores them
+    as cached tickets, which pretix serves for downloads and email attachments.
+    """
+    from pretix_passbook.passbook import PassbookOutput
+
+    output = PassbookOutput(event)
+    if not output.is_enabled or not event.settings.get("ticketoutput_passbook_pregenerate", as_type=bool):
+        return
+    try:
+        order = event.orders.get(pk=order, status=Order.STATUS_PAID)
+    except Order.DoesNotExist:
+        return
+
+    cached = set(
+        CachedTicket.objects.filter(
+            order_position__order=order, provider=output.identifier, file__isnull=False
+        ).exclude(file="").values_list("order_position_id", flat=True)
+    )
+    positions = [op for op in order.positions_with_tickets if op.pk not in cached]
+    for op, (filename, ttype, data) in output.generate_batch(positions):
+        path, ext = os.path.splitext(filename)
+        # Empty cached tickets belong to generations that are still running, and pretix serves
+        # the latest one with a file, so they are left for pretix to clean up
+        ct = CachedTicket.objects.create(
+            order_position=op, provider=output.identifier, extension=ext, type=ttype, file=None
+        )
+        ct.file.save(filename, ContentFile(data))
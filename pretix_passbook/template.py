@@ -0,0 +1,434 @@
+from typing import List, Tuple
+
+import hashlib
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import get_language
+from pretix.base.models import (
+    Event, Item, ItemMetaValue, ItemVariation, SubEvent,
+)
+from pretix.multidomain.urlreverse import build_absolute_uri
+
+from pretix_passbook.assets import (
+    DEFAULT_ASSETS, derived_asset_name, get_setting_asset, get_storage_asset,
+)
+from pretix_passbook.geocoding import cached_location, venue_address
+from pretix_passbook.i18n import format_datetime, get_labels
+from pretix_passbook.metrics import count
+from pretix_passbook.webservice import webservice_enabled, webservice_url
+
+SELFSCALE_ASSETS = (
+    ("icon@2x.png", "ticketoutput_passbook_icon2x"),
+    ("icon@3x.png", "ticketoutput_passbook_icon3x"),
+    ("logo@2x.png", "ticketoutput_passbook_logo2x"),
+    ("logo@3x.png", "ticketoutput_passbook_logo3x"),
+    ("background@2x.png", "ticketoutput_passbook_background2x"),
+    ("background@3x.png", "ticketoutput_passbook_background3x"),
+)
+MAX_TEMPLATES = 256
+LOCAL_TEMPLATE_TIMEOUT = 60
+MAX_DATE_TEMPLATES = django_settings.CONFIG_FILE.getint("passbook", "date_templates", fallback=4096)
+DATE_FIELDS = (
+    "event_name",
+    "logo_text",
+    "header_fields",
+    "admission",
+    "date_from_display",
+    "date_to_display",
+    "relevant_date",
+    "expiration_date",
+    "website",
+    "location",
+)
+
+_templates = OrderedDict()
+_date_templates = OrderedDict()
+_templates_lock = threading.Lock()
+_local_versions = {}
+
+
+class PassTemplate(
+    namedtuple(
+        "PassTemplate",
+        (
+            "event_name",
+            "organizer_name",
+            "pass_type_id",
+            "team_id",
+            "logo_text",
+            "header_fields",
+            "admission",
+            "date_from_display",
+            "date_to_display",
+            "relevant_date",
+            "expiration_date",
+            "contact_mail",
+            "website",
+            "location",
+            "files",
+            "background_color",
+            "foreground_color",
+            "label_color",
+            "webservice",
+            "webservice_url",
+            "items",
+        ),
+    )
+):
+    """
+    Everything in a pass that is the same for all tickets of an event or a date of an event
+    series in one language. ``header_fields`` are ``(key, value, label)`` tuples, ``files`` are
+    ``(filename, asset)`` tuples and ``location`` is a ``(latitude, longitude)`` tuple. ``items``
+    holds the ``ItemFragment`` of every product that passes have been built for, so fragments
+    are discarded together with the template.
+    """
+
+    __slots__ = ()
+
+
+class DateTemplate(namedtuple("DateTemplate", DATE_FIELDS)):
+    """
+    The fields of a ``PassTemplate`` that differ between the dates of an event series. Templates
+    of dates are made from the template of their event by replacing these fields, so they share
+    everything else with it, including the item fragments.
+    """
+
+    __slots__ = ()
+
+
+class ItemFragment(namedtuple("ItemFragment", ("product", "backfield", "thumbnail"))):
+    """
+    Everything in a pass that only depends on the product and variation of a ticket: the product
+    name, the text of the ``pretix_passbook_backfield`` property and the thumbnail image from
+    the ``pretix_passbook_thumbnail`` property as an asset.
+    """
+
+    __slots__ = ()
+
+
+def build_date_template(event: Event, subevent: SubEvent = None, logo: bool = False) -> DateTemplate:
+    ev = subevent or event
+    tz = event.timezone
+    settings = event.settings
+
+    # The ticket header is what is visible when the ticket is collapsed in the stack of tickets.
+    # We differentiate these cases:
+    #
+    # 1. If there is no custom logo, we always show
+    #    [ PRETIX LOGO ]  [ EVENT TITLE ]
+    #    to make sure you can tell the ticket apart from other pretix tickets. In an event series
+    #    we'll also add the date to the event title.
+    #
+    #  2. If there is a custom logo and we're in an event series or have a custom admission time, we show
+    #    [ CUSTOM LOGO ]                    [ EVENT ADMISSION ]
+    #    to make sure you can tell the ticket apart from other tickets from the same entity.
+    #
+    #  3. If there is a custom logo and we're not in an event series and do not custom admission time, we show
+    #    [ CUSTOM LOGO ]
+
+    labels = get_labels()
+    admission = format_datetime(ev.date_admission, tz) if ev.date_admission else None
+    date_from_display = ev.get_date_from_display(tz, short=True)
+    header_fields = ()
+    if logo:
+        logo_text = None
+        if admission:
+            header_fields = (("doorsAdmissionHeader", admission, labels["admission_time"]),)
+        elif event.has_subevents:
+            header_fields = (
+                ("doorsAdmissionHeader", date_from_display, labels["begin"]),
+            )
+    else:
+        logo_text = str(ev.name)
+        if event.has_subevents:
+            logo_text += f" ({date_from_display})"
+
+    show_date_to = settings.show_date_to
+    date_from_local_time = ev.date_from.astimezone(tz)
+    date_to_local_time = ev.date_to.astimezone(tz) if ev.date_to else None
+    if (
+        show_date_to
+        and date_to_local_time
+        and date_to_local_time.date() != date_from_local_time.date()
+    ):
+        relevant_date, expiration_date = None, date_to_local_time.isoformat()
+    else:
+        relevant_date, expiration_date = date_from_local_time.isoformat(), None
+
+    if subevent:
+        website = build_absolute_uri(event, "presale:event.index", {"subevent": subevent.pk})
+    else:
+        website = build_absolute_uri(event, "presale:event.index")
+
+    location = None
+    if settings.passbook_latitude and settings.passbook_longitude:
+        location = (settings.passbook_latitude, settings.passbook_longitude)
+    else:
+        # Coordinates entered by hand win over geocoded venues, which are only read from the cache
+        # here and looked up ahead of time by ``geocode_passbook`` or the periodic task.
+        for obj in (subevent, event):
+            if obj is None:
+                continue
+            if obj.geo_lat and obj.geo_lon:
+                location = (obj.geo_lat, obj.geo_lon)
+            else:
+                location = cached_location(venue_address(obj, settings.locale))
+            if location:
+                break
+
+    return DateTemplate(
+        event_name=str(ev.name),
+        logo_text=logo_text,
+        header_fields=header_fields,
+        admission=admission,
+        date_from_display=date_from_display,
+        date_to_display=ev.get_date_to_display(tz, short=True) if show_date_to and ev.date_to else None,
+        relevant_date=relevant_date,
+        expiration_date=expiration_date,
+        website=website,
+        location=location,
+    )
+
+
+def build_template(event: Event, subevent: SubEvent = None) -> PassTemplate:
+    settings = event.settings
+    logo = get_setting_asset(settings, "ticketoutput_passbook_logo")
+    icon = get_setting_asset(settings, "ticketoutput_passbook_icon")
+    background = get_setting_asset(settings, "ticketoutput_passbook_background")
+    files = [
+        ("icon.png", icon or DEFAULT_ASSETS["icon.png"]),
+        ("logo.png", logo or DEFAULT_ASSETS["logo.png"]),
+    ]
+    if background:
+        files.append(("background.png", background))
+    if settings.get("ticketoutput_passbook_selfscale"):
+        for filename, key in SELFSCALE_ASSETS:
+            asset = get_setting_asset(settings, key)
+            if asset:
+                files.append((filename, asset))
+    else:
+        for name, asset in (("icon", icon), ("logo", logo), ("background", background)):
+            if not asset:
+                continue
+            for scale in (2, 3):
+                variant = get_storage_asset(derived_asset_name(asset.digest, scale), "derived")
+                if variant:
+                    files.append(("{}@{}x.png".format(name, scale), variant))
+
+    webservice = webservice_enabled(event)
+    url = webservice_url(event) if webservice else None
+
+    return PassTemplate(
+        organizer_name=str(event.organizer),
+        pass_type_id=settings.passbook_pass_type_id,
+        team_id=settings.passbook_team_id,
+        contact_mail=settings.contact_mail,
+        files=tuple(files),
+        background_color=settings.get("ticketoutput_passbook_bg_color"),
+        foreground_color=settings.get("ticketoutput_passbook_fg_color"),
+        label_color=settings.get("ticketoutput_passbook_label_color"),
+        webservice=webservice,
+        # Wallet only talks to web services over HTTPS
+        webservice_url=url if url and url.startswith("https://") else None,
+        items={},
+        **build_date_template(event, subevent, logo=bool(logo))._asdict(),
+    )
+
+
+def build_item_fragment(item: Item, variation: ItemVariation = None) -> ItemFragment:
+    product = str(item.name)
+    if variation:
+        product += " - " + str(variation)
+
+    try:
+        meta_data = item.meta_data
+    except ItemMetaValue.DoesNotExist:
+        meta_data = {}
+
+    thumbnail = None
+    thumbnail_name = meta_data.get("pretix_passbook_thumbnail")
+    if thumbnail_name and re.match(r"(\d+/)?pub/", thumbnail_name):
+        thumbnail = get_storage_asset(thumbnail_name, "pretix_passbook_thumbnail")
+
+    return ItemFragment(
+        product=product,
+        backfield=meta_data.get("pretix_passbook_backfield") or None,
+        thumbnail=thumbnail,
+    )
+
+
+def get_item_fragment(template: PassTemplate, item: Item, variation: ItemVariation = None) -> ItemFragment:
+    """
+    Returns the fragment of a product within a template. Changes to products, their variations or
+    meta data invalidate the templates of the event, and with them all fragments.
+    """
+    key = (item.pk, variation.pk if variation else None)
+    fragment = template.items.get(key)
+    if fragment is not None:
+        count("item", "hit")
+        return fragment
+    count("item", "miss")
+    fragment = template.items[key] = build_item_fragment(item, variation)
+    return fragment
+
+
+def template_assets(event: Event) -> Tuple[List[Tuple[str, str]], bool]:
+    """
+    Returns the storage names and setting keys of the images that are part of the templates of an
+    event, and whether they are scaled by the organizer.
+    """
+    selfscale = bool(event.settings.get("ticketoutput_passbook_selfscale"))
+    keys = ["ticketoutput_passbook_icon", "ticketoutput_passbook_logo", "ticketoutput_passbook_background"]
+    if selfscale:
+        keys += [key for filename, key in SELFSCALE_ASSETS]
+    names = []
+    for key in keys:
+        value = event.settings.get(key, as_type=str)
+        if value and value.startswith("file://"):
+            names.append((value[7:], key))
+    return names, selfscale
+
+
+def _version_keys(event: Event, subevent: SubEvent = None):
+    keys = (
+        "pretix_passbook_template_global",
+        "pretix_passbook_template_organizer_{}".format(event.organizer_id),
+        "pretix_passbook_template_event_{}".format(event.pk),
+    )
+    if subevent:
+        keys += ("pretix_passbook_template_subevent_{}".format(subevent.pk),)
+    return keys
+
+
+def _versions(event: Event, subevent: SubEvent = None) -> tuple:
+    keys = _version_keys(event, subevent)
+    if not django_settings.REAL_CACHE_USED:
+        # The dummy cache never returns a version, so this process keeps counters of the changes
+        # it made itself. Other processes cannot tell it about theirs, so templates are also
+        # rebuilt after ``LOCAL_TEMPLATE_TIMEOUT`` seconds.
+        period = str(int(time.monotonic() // LOCAL_TEMPLATE_TIMEOUT))
+        with _templates_lock:
+            return tuple("{}-{}".format(_local_versions.get(key, 0), period) for key in keys)
+
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return tuple(versions[key] for key in keys)
+
+
+def template_version(event: Event) -> str:
+    """
+    Identifies the state of the settings the templates of an event are currently built from.
+    """
+    return hashlib.sha256("\0".join(_versions(event)).encode()).hexdigest()
+
+
+def _memo_get(memo: OrderedDict, key):
+    with _templates_lock:
+        template = memo.get(key)
+        if template is not None:
+            memo.move_to_end(key)
+        return template
+
+
+def _memo_set(memo: OrderedDict, key, template, size: int):
+    with _templates_lock:
+        memo[key] = template
+        while len(memo) > size:
+            memo.popitem(last=False)
+
+
+def _date_fields(subevent: SubEvent) -> tuple:
+    """
+    The fields of a date that its template is built from. Dates changed in bulk do not send
+    signals, so templates of dates are also looked up by these.
+    """
+    return (
+        str(subevent.name),
+        repr(subevent.location.data) if subevent.location else None,
+        subevent.date_from,
+        subevent.date_to,
+        subevent.date_admission,
+        subevent.geo_lat,
+        subevent.geo_lon,
+    )
+
+
+def get_template(event: Event, subevent: SubEvent = None, build: bool = True) -> PassTemplate:
+    """
+    Returns the template for passes of the given event or date in the current language. Templates
+    are kept in memory until the settings of the event, its organizer or the system change, which
+    all workers learn about through version tokens in the cache backend. Without Redis or
+    memcached, workers only learn about their own changes and keep templates for up to
+    ``LOCAL_TEMPLATE_TIMEOUT`` seconds. Templates of dates are kept separately, in up to
+    ``date_templates`` entries, and also rebuilt when the date itself changes. With
+    ``build=False``, ``None`` is returned instead of building a template that is not in memory.
+    """
+    language = get_language()
+    versions = _versions(event, subevent)
+    if subevent:
+        date_key = (subevent.pk, language, versions, _date_fields(subevent))
+        template = _memo_get(_date_templates, date_key)
+        if template is not None:
+            count("date", "hit")
+            return template
+
+    key = (event.pk, language, versions[:3])
+    template = _memo_get(_templates, key)
+    if template is not None:
+        count("template", "hit")
+    elif not build:
+        return None
+    else:
+        count("template", "miss")
+        template = build_template(event)
+        _memo_set(_templates, key, template, MAX_TEMPLATES)
+
+    if not subevent:
+        return template
+    if not build:
+        return None
+    count("date", "miss")
+    # Event templates only have no logo text if there is a custom logo
+    template = template._replace(
+        **build_date_template(event, subevent, logo=template.logo_text is None)._asdict()
+    )
+    _memo_set(_date_templates, date_key, template, MAX_DATE_TEMPLATES)
+    return template
+
+
+def _bump_version(key: str):
+    if django_settings.REAL_CACHE_USED:
+        cache.set(key, uuid.uuid4().hex, None)
+    else:
+        with _templates_lock:
+            _local_versions[key] = _local_versions.get(key, 0) + 1
+
+
+def invalidate_templates(event_id: int = None, organizer_id: int = None, subevent_id: int = None):
+    """
+    Discards the template of a date, the templates of an event, of all events of an organizer or,
+    if neither is given, of all events. This happens both right away and once the current
+    transaction is committed, since other workers might build new templates from the old data in
+    the meantime.
+    """
+    if subevent_id:
+        key = "pretix_passbook_template_subevent_{}".format(subevent_id)
+    elif event_id:
+        key = "pretix_passbook_template_event_{}".format(event_id)
+    elif organizer_id:
+        key = "pretix_passbook_template_organizer_{}".format(organizer_id)
+    else:
+        key = "pretix_passbook_template_global"
+    _bump_version(key)
+    transaction.on_commit(lambda: _bump_version(key))
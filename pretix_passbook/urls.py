@@ -0,0 +1,40 @@
+from django.urls import include, re_path
+from pretix.multidomain import event_url
+
+from .views import (
+    OrderBundleView, latest_pass, log, registration, serial_numbers,
+)
+
+event_patterns = [
+    event_url(
+        r"^passbook/order/(?P<order>[^/]+)/(?P<secret>[A-Za-z0-9]+)/bundle$",
+        OrderBundleView.as_view(),
+        name="order.bundle",
+    ),
+    re_path(
+        r"^passbook/webservice/v1/",
+        include(
+            [
+                event_url(
+                    r"^devices/(?P<device>[^/]+)/registrations/(?P<pass_type>[^/]+)/(?P<serial>[^/]+)$",
+                    registration,
+                    name="webservice.registration",
+                    require_live=False,
+                ),
+                event_url(
+                    r"^devices/(?P<device>[^/]+)/registrations/(?P<pass_type>[^/]+)$",
+                    serial_numbers,
+                    name="webservice.serials",
+                    require_live=False,
+                ),
+                event_url(
+                    r"^passes/(?P<pass_type>[^/]+)/(?P<serial>[^/]+)$",
+                    latest_pass,
+                    name="webservice.pass",
+                    require_live=False,
+                ),
+                event_url(r"^log$", log, name="webservice.log", require_live=False),
+            ]
+        ),
+    ),
+]
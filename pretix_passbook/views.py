@@ -0,0 +1,190 @@
+import json
+import logging
+from datetime import datetime, timezone
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from django.views.generic import View
+from pretix.base.i18n import language
+from pretix.base.models import OrderPosition
+from pretix.presale.views.order import OrderDetailMixin
+
+from pretix_passbook.cache import pass_etag
+from pretix_passbook.models import Device, IssuedPass, Registration
+from pretix_passbook.passbook import PassbookOutput
+from pretix_passbook.template import template_version
+from pretix_passbook.webservice import (
+    authentication_token, record_issued_pass, serial_number,
+    webservice_enabled,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _check_pass_type(request, pass_type):
+    if not webservice_enabled(request.event) or pass_type != request.event.settings.passbook_pass_type_id:
+        raise Http404()
+
+
+def _authenticated(request, serial):
+    auth = request.headers.get("Authorization", "")
+    return auth.startswith("ApplePass ") and constant_time_compare(
+        auth[len("ApplePass "):], authentication_token(serial)
+    )
+
+
+def _get_position(request, serial):
+    try:
+        pk = int(serial.rsplit("-", 1)[1])
+        op = OrderPosition.all.select_related("order").get(pk=pk, order__event=request.event)
+    except (IndexError, ValueError, OrderPosition.DoesNotExist):
+        raise Http404()
+    if serial_number(op) != serial:
+        raise Http404()
+    return op
+
+
+def _etag_matches(request, etag):
+    # If-None-Match uses the weak comparison
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    return "*" in etags or etag.removeprefix("W/") in {e.removeprefix("W/") for e in etags}
+
+
+def _tag(dt):
+    return str(int(dt.timestamp() * 1000000))
+
+
+@csrf_exempt
+@require_http_methods(["POST", "DELETE"])
+def registration(request, device, pass_type, serial, **kwargs):
+    _check_pass_type(request, pass_type)
+    if not _authenticated(request, serial):
+        return HttpResponse(status=401)
+
+    if request.method == "DELETE":
+        Registration.objects.filter(
+            device__library_identifier=device,
+            issued_pass__event=request.event,
+            issued_pass__serial_number=serial,
+        ).delete()
+        return HttpResponse(status=200)
+
+    try:
+        push_token = json.loads(request.body)["pushToken"]
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest()
+
+    op = _get_position(request, serial)
+    with transaction.atomic():
+        issued_pass, _ = IssuedPass.objects.get_or_create(
+            order_position=op,
+            defaults={"event": request.event, "serial_number": serial},
+        )
+        record_issued_pass(issued_pass, op)
+        d, _ = Device.objects.update_or_create(
+            library_identifier=device, defaults={"push_token": push_token}
+        )
+        _, created = Registration.objects.get_or_create(device=d, issued_pass=issued_pass)
+    return HttpResponse(status=201 if created else 200)
+
+
+@require_http_methods(["GET"])
+def serial_numbers(request, device, pass_type, **kwargs):
+    _check_pass_type(request, pass_type)
+    qs = IssuedPass.objects.filter(
+        event=request.event, registrations__device__library_identifier=device
+    )
+    since = request.GET.get("passesUpdatedSince")
+    if since:
+        try:
+            since = datetime.fromtimestamp(int(since) / 1000000, tz=timezone.utc)
+        except ValueError:
+            return HttpResponseBadRequest()
+        qs = qs.filter(last_modified__gt=since)
+
+    passes = list(qs.values_list("serial_number", "last_modified"))
+    if not passes:
+        return HttpResponse(status=204)
+    return JsonResponse(
+        {
+            "serialNumbers": [s for s, _ in passes],
+            "lastUpdated": _tag(max(lm for _, lm in passes)),
+        }
+    )
+
+
+@require_http_methods(["GET"])
+def latest_pass(request, pass_type, serial, **kwargs):
+    _check_pass_type(request, pass_type)
+    if not _authenticated(request, serial):
+        return HttpResponse(status=401)
+
+    issued_pass = IssuedPass.objects.filter(event=request.event, serial_number=serial).first()
+    if issued_pass:
+        # Answer conditional requests from the modification time alone, without building the pass
+        since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+        if since is not None and int(issued_pass.last_modified.timestamp()) <= since:
+            return HttpResponse(status=304)
+        # Marking a pass as updated discards its fingerprint, so a stored one is still current
+        # as long as the settings have not changed either
+        if (
+            issued_pass.fingerprint
+            and _etag_matches(request, pass_etag(issued_pass.fingerprint))
+            and issued_pass.settings_version == template_version(request.event)
+        ):
+            response = HttpResponse(status=304)
+            response["ETag"] = pass_etag(issued_pass.fingerprint)
+            response["Last-Modified"] = http_date(issued_pass.last_modified.timestamp())
+            return response
+
+    op = _get_position(request, serial)
+    output = PassbookOutput(request.event)
+    with language(op.order.locale, request.event.settings.region):
+        prepared = output.prepare(op)
+        fingerprint = prepared[1].fingerprint(prepared[2])
+        etag = pass_etag(fingerprint)
+        if _etag_matches(request, etag):
+            # The pass has been built, but it does not need to be signed and packed
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(content_type="application/vnd.apple.pkpass")
+            output.write(op, response, prepared=prepared)
+    response["ETag"] = etag
+    if issued_pass:
+        record_issued_pass(issued_pass, op, fingerprint)
+        response["Last-Modified"] = http_date(issued_pass.last_modified.timestamp())
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def log(request, **kwargs):
+    try:
+        messages = json.loads(request.body)["logs"]
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest()
+    for message in messages:
+        logger.info("Wallet web service log for %s: %s", request.event, message)
+    return HttpResponse(status=200)
+
+
+class OrderBundleView(OrderDetailMixin, View):
+    """
+    Downloads the passes of all tickets of an order as one ``.pkpasses`` bundle, which is
+    written to the response as the passes are generated.
+    """
+
+    def get(self, request, *args, **kwargs):
+        response = self.verify_order_access()
+        if response:
+            return response
+        output = PassbookOutput(request.event)
+        if not output.is_enabled or not self.order.ticket_download_available:
+            raise Http404()
+        response = HttpResponse()
+        filename, response["Content-Type"] = output.write_order(self.order, response)
+        response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+        return response
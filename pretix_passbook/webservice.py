@@ -0,0 +1,181 @@
+import operator
+import threading
+from collections import defaultdict
+from datetime import datetime
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils.crypto import salted_hmac
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from functools import reduce
+from pretix.base.models import Event, LogEntry, OrderPosition, SubEvent
+from pretix.multidomain.urlreverse import build_absolute_uri
+
+from pretix_passbook.models import IssuedPass
+
+# Settings that are part of pass content besides the ones of this plugin
+PASS_SETTINGS = {
+    "contact_mail",
+    "locale",
+    "name_scheme",
+    "region",
+    "show_date_to",
+    "show_times",
+    "timezone",
+}
+
+_marks = threading.local()
+
+
+def serial_number(order_position: OrderPosition) -> str:
+    order = order_position.order
+    return "%s-%s-%s-%d" % (
+        order.event.organizer.slug,
+        order.event.slug,
+        order.code,
+        order_position.pk,
+    )
+
+
+def authentication_token(serial: str) -> str:
+    """
+    The token devices use to authenticate requests for the pass with the given serial number.
+    It is derived from the serial number, so it does not need to be stored.
+    """
+    return salted_hmac(
+        "pretix_passbook.webservice", serial, algorithm="sha256"
+    ).hexdigest()
+
+
+def webservice_url(event: Event) -> str:
+    """
+    The ``webServiceURL`` of the passes of an event. Devices append ``v1/…`` to it themselves.
+    """
+    url = build_absolute_uri(event, "plugins:pretix_passbook:webservice.log")
+    return url[: -len("v1/log")]
+
+
+def webservice_enabled(event: Event) -> bool:
+    return bool(event.settings.get("ticketoutput_passbook_webservice", as_type=bool))
+
+
+def mark_passes_updated(event: Event, issued_passes):
+    """
+    Bumps the modification time of the given issued passes, discards the fingerprints they were
+    last built with and notifies the registered devices once the current transaction is
+    committed.
+    """
+    from pretix_passbook.tasks import send_pushes
+
+    ids = list(issued_passes.values_list("pk", flat=True))
+    if not ids:
+        return
+    IssuedPass.objects.filter(pk__in=ids).update(last_modified=now(), fingerprint="")
+    transaction.on_commit(lambda: send_pushes.apply_async(args=(event.pk, ids)))
+
+
+def affects_passes(key: str) -> bool:
+    """
+    Whether the setting with the given key is part of the content of passes.
+    """
+    return key.startswith(("ticketoutput_passbook_", "passbook_")) or key in PASS_SETTINGS
+
+
+class _PendingMarks:
+    """
+    The conditions of the ``mark_dependent_passes`` calls of a thread, and so of its database
+    connection, that have not been committed yet. Django does not tell whether a commit hook
+    was discarded together with a savepoint, so the hook is registered for every call and the
+    first one to run applies the conditions of all of them. Conditions of a transaction that
+    has been rolled back are discarded with the next call outside of a transaction, or applied
+    with the next transaction that is committed, which only updates their passes needlessly.
+    """
+
+    def __init__(self):
+        self.conditions = set()
+
+    def add(self, dependency: dict):
+        if transaction.get_autocommit():
+            # Outside of transactions, all conditions left are ones that have been rolled back
+            self.conditions.clear()
+        self.conditions.add(tuple(sorted(dependency.items())))
+        transaction.on_commit(self)
+
+    def __call__(self):
+        from pretix_passbook.tasks import send_pushes
+
+        conditions, self.conditions = self.conditions, set()
+        if not conditions:
+            return
+        with scopes_disabled():
+            qs = IssuedPass.objects.all()
+            # An empty condition stands for all passes
+            if all(conditions):
+                qs = qs.filter(reduce(operator.or_, (Q(**dict(c)) for c in conditions)))
+            passes = defaultdict(list)
+            for pk, event_id in qs.values_list("pk", "event_id"):
+                passes[event_id].append(pk)
+            if not passes:
+                return
+            IssuedPass.objects.filter(pk__in=[pk for ids in passes.values() for pk in ids]).update(
+                last_modified=now(), fingerprint=""
+            )
+        for event_id, ids in passes.items():
+            send_pushes.apply_async(args=(event_id, ids))
+
+
+def mark_dependent_passes(**dependency):
+    """
+    Marks the issued passes that were built from the given object as updated, e.g. with
+    ``item_id=…``, ``event__organizer_id=…`` or, without arguments, all of them. Marks are
+    collected until the current transaction is committed, so saving a form that changes
+    many objects of an event updates every affected pass only once.
+    """
+    if getattr(_marks, "pending", None) is None:
+        _marks.pending = _PendingMarks()
+    _marks.pending.add(dependency)
+
+
+def mark_changed_dates(since: datetime):
+    """
+    Marks the issued passes of dates that have been changed since the given time as updated, if
+    they have not been updated after the change. Dates changed in bulk are saved without sending
+    signals, so their changes are only found in the log.
+    """
+    changes = (
+        LogEntry.objects.filter(
+            action_type="pretix.subevent.changed",
+            content_type=ContentType.objects.get_for_model(SubEvent),
+            datetime__gte=since,
+        )
+        .order_by()
+        .values("object_id")
+        .annotate(changed=Max("datetime"))
+        .values_list("object_id", "changed")
+    )
+    with transaction.atomic():
+        for subevent_id, changed in changes:
+            mark_dependent_passes(subevent_id=subevent_id, last_modified__lt=changed)
+
+
+def record_issued_pass(issued_pass: IssuedPass, order_position: OrderPosition, fingerprint: str = None):
+    """
+    Stores what an issued pass has been built from, if anything changed since it was last
+    issued. Without a ``fingerprint``, only the objects the pass depends on are stored.
+    """
+    from pretix_passbook.template import template_version
+
+    values = {
+        "subevent_id": order_position.subevent_id,
+        "item_id": order_position.item_id,
+        "variation_id": order_position.variation_id,
+        "seat_id": order_position.seat_id,
+    }
+    if fingerprint:
+        values["fingerprint"] = fingerprint
+        values["settings_version"] = template_version(order_position.order.event)
+    if any(getattr(issued_pass, key) != value for key, value in values.items()):
+        IssuedPass.objects.filter(pk=issued_pass.pk).update(**values)
+        for key, value in values.items():
+            setattr(issued_pass, key, value)
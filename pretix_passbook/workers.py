@@ -0,0 +1,60 @@
+from typing import List, Tuple
+
+# Functions in this module are executed in freshly spawned worker processes, so this module may
+# only import Django models once Django has been set up.
+
+
+def init_worker():
+    import django
+
+    django.setup()
+
+
+def pass_filename(order_position) -> str:
+    return "{}-{}-{}.pkpass".format(
+        order_position.order.event.slug,
+        order_position.order.code,
+        order_position.positionid,
+    )
+
+
+def generate_chunk(event_id: int, position_ids: List[int]) -> List[Tuple[str, bytes]]:
+    """
+    Generates the passes for the given positions of an event and returns tuples of file names
+    and pass contents. Positions that do not get a ticket are skipped.
+    """
+    from django_scopes import scopes_disabled
+    from pretix.base.models import Event, OrderPosition
+
+    from .passbook import PassbookOutput
+
+    with scopes_disabled():
+        event = Event.objects.select_related("organizer").get(pk=event_id)
+        output = PassbookOutput(event)
+        positions = [
+            op
+            for op in output.prefetch_positions(
+                OrderPosition.objects.filter(pk__in=position_ids).order_by("pk")
+            )
+            if op.generate_ticket
+        ]
+        return [
+            (pass_filename(op), data)
+            for op, (filename, mimetype, data) in output.generate_batch(positions)
+        ]
+
+
+def serve_signer(connection):
+    """
+    Signs the requests of a ``PoolSigner`` that arrive through ``connection`` until it is closed.
+    """
+    init_worker()
+
+    from .signserver import handle_request
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        connection.send(handle_request(request))
@@ -0,0 +1,28 @@
+import pytest
+from django_scopes import scopes_disabled
+
+from pretix_passbook import template
+from pretix_passbook.management.commands.benchmark_passbook import Fixtures
+
+
+@pytest.fixture
+def fixtures(db):
+    with scopes_disabled():
+        fixtures = Fixtures()
+        yield fixtures
+        fixtures.cleanup()
+
+
+@pytest.fixture
+def position(fixtures, request):
+    # Tests can ask for another scenario with ``@pytest.mark.parametrize("position", [...], indirect=True)``
+    return fixtures.event(getattr(request, "param", "plain"))
+
+
+@pytest.fixture(autouse=True)
+def templates():
+    # Primary keys are reused after the test database was rolled back
+    yield
+    template._templates.clear()
+    template._date_templates.clear()
+    template._local_versions.clear()
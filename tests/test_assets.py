@@ -0,0 +1,37 @@
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from pretix_passbook.assets import (
+    AssetCache, asset_cache, forget_storage_asset, get_storage_asset,
+)
+
+
+@pytest.fixture
+def name():
+    name = "passbook-test/missing.png"
+    yield name
+    default_storage.delete(name)
+    asset_cache.clear()
+
+
+def test_missing_file_found_after_timeout(name, monkeypatch):
+    monkeypatch.setattr(AssetCache, "MISSING_TIMEOUT", 0)
+    assert get_storage_asset(name, "test") is None
+    name = default_storage.save(name, ContentFile(b"image"))
+    assert get_storage_asset(name, "test").data == b"image"
+
+
+def test_missing_file_forgotten(name):
+    assert get_storage_asset(name, "test") is None
+    name = default_storage.save(name, ContentFile(b"image"))
+    assert get_storage_asset(name, "test") is None
+    forget_storage_asset(name, "test")
+    assert get_storage_asset(name, "test").data == b"image"
+
+
+def test_found_file_kept(name):
+    name = default_storage.save(name, ContentFile(b"image"))
+    asset = get_storage_asset(name, "test")
+    default_storage.delete(name)
+    assert get_storage_asset(name, "test") is asset
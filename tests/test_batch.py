@@ -0,0 +1,94 @@
+import datetime
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from hierarkey.proxy import dirty_cache_keys
+from pretix.base.models import Event, OrderPosition
+
+from pretix_passbook.passbook import PassbookOutput
+
+
+@pytest.fixture
+def order(fixtures):
+    with scopes_disabled():
+        first = fixtures.event("series")
+        order = first.order
+        event = order.event
+        item = first.item
+        variation = item.variations.create(value="Balcony")
+        for day in range(2):
+            item.program_times.create(
+                start=event.date_from + datetime.timedelta(days=day),
+                end=event.date_to + datetime.timedelta(days=day),
+            )
+        backfield = event.item_meta_properties.create(name="pretix_passbook_backfield")
+        item.meta_values.create(property=backfield, value="Please arrive early")
+        seated = event.subevents.create(
+            name="Seated date",
+            date_from=event.date_from + datetime.timedelta(days=7),
+            seating_plan=fixtures.organizer.seating_plans.create(name="Plan", layout="{}"),
+            active=True,
+        )
+        extra = event.items.create(name="Parking", default_price=0)
+        extra_variation = extra.variations.create(value="Covered")
+
+        for i in range(12):
+            seats = [
+                event.seats.create(
+                    subevent=seated, seat_guid="seat-{}-{}".format(i, j), row_name=str(j), seat_number=str(i), product=item
+                )
+                for j in range(2)
+            ]
+            position = order.positions.create(
+                item=item,
+                variation=variation if i % 2 else None,
+                subevent=seated,
+                seat=seats[0],
+                price=0,
+                attendee_name_parts={"_scheme": "full", "full_name": "Attendee {}".format(i)},
+            )
+            # Add-ons without a seat of their own show the seat of the position they belong to
+            order.positions.create(
+                item=extra,
+                variation=extra_variation if i % 2 else None,
+                subevent=seated,
+                seat=seats[1] if i % 3 else None,
+                addon_to=position,
+                price=0,
+            )
+
+        # Settings written in an open transaction bypass the cache, which they would not do in
+        # production
+        dirty_cache_keys.set(set())
+        return order
+
+
+def _batch(event, positions):
+    return list(PassbookOutput(event).generate_batch(positions))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("as_list", [False, True])
+def test_constant_number_of_queries(order, as_list, django_assert_num_queries):
+    with scopes_disabled():
+        event = Event.objects.get(pk=order.event_id)
+        positions = OrderPosition.objects.filter(order=order).order_by("pk")
+        count = positions.count()
+        assert count >= 20
+
+        # Templates, item fragments and the signing material are only built once per process
+        _batch(event, positions)
+
+        # A list is prefetched with a query per relation that is used, so the single position
+        # uses all of them
+        single = positions.filter(
+            variation__isnull=False, seat__isnull=False, addon_to__seat__isnull=False
+        )[:1]
+        everything = positions.all()
+        if as_list:
+            single, everything = list(single), list(everything)
+        with CaptureQueriesContext(connection) as queries:
+            assert len(_batch(event, single)) == 1
+        with django_assert_num_queries(len(queries)):
+            assert len(_batch(event, everything)) == count
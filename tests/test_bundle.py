@@ -0,0 +1,55 @@
+import io
+import pytest
+import zipfile
+from django_scopes import scopes_disabled
+from pretix.base.services.tickets import get_tickets_for_order
+
+from pretix_passbook.passbook import PassbookOutput
+
+
+@pytest.fixture
+def order(position):
+    event = position.order.event
+    event.live = True
+    event.save(update_fields=["live"])
+    event.settings.ticket_download = True
+    event.settings.ticketoutput_passbook__enabled = True
+    with scopes_disabled():
+        position.order.positions.create(item=position.item, price=position.price)
+    return position.order
+
+
+def _url(order, secret=None):
+    return "/{}/{}/passbook/order/{}/{}/bundle".format(
+        order.event.organizer.slug, order.event.slug, order.code, secret or order.secret
+    )
+
+
+def test_emails_attach_single_passes(order):
+    with scopes_disabled():
+        tickets = get_tickets_for_order(order)
+    assert len(tickets) == 2
+    assert all(name.endswith(".pkpass") for name, ct in tickets)
+
+
+def test_single_ticket_order(position):
+    with scopes_disabled():
+        filename, ttype, data = PassbookOutput(position.order.event).generate_order(position.order)
+    assert ttype == "application/vnd.apple.pkpass"
+    assert "pass.json" in zipfile.ZipFile(io.BytesIO(data)).namelist()
+
+
+def test_bundle_view(client, order):
+    r = client.get(_url(order))
+    assert r.status_code == 200
+    assert r["Content-Type"] == "application/vnd.apple.pkpasses"
+    assert len(zipfile.ZipFile(io.BytesIO(r.content)).namelist()) == 2
+
+    assert client.get(_url(order, secret="wrong")).status_code == 404
+    order.event.settings.ticketoutput_passbook__enabled = False
+    assert client.get(_url(order)).status_code == 404
+
+
+def test_bundle_button(client, order):
+    r = client.get("/{}/{}/order/{}/{}/".format(order.event.organizer.slug, order.event.slug, order.code, order.secret))
+    assert _url(order) in r.content.decode()
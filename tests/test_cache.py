@@ -0,0 +1,56 @@
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from django_scopes import scopes_disabled
+
+from pretix_passbook.passbook import PassbookOutput
+
+pytestmark = pytest.mark.usefixtures("locmem_cache")
+
+
+@pytest.fixture
+def locmem_cache():
+    with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+        yield
+        cache.clear()
+
+
+def _signed_passes():
+    return [key for key in cache._cache if "pretix_passbook_pkpass_" in key]
+
+
+def test_single_download_cached(position):
+    with scopes_disabled():
+        output = PassbookOutput(position.order.event)
+        data = output.generate(position)[2]
+        assert len(_signed_passes()) == 1
+        assert output.generate(position)[2] == data
+
+
+def test_batch_not_cached(position):
+    with scopes_disabled():
+        output = PassbookOutput(position.order.event)
+        assert len(list(output.generate_batch([position]))) == 1
+        assert output.generate_order(position.order)
+        assert _signed_passes() == []
+
+
+class _Chunks:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+def test_write_streams_and_caches(position):
+    with scopes_disabled():
+        output = PassbookOutput(position.order.event)
+        first = _Chunks()
+        output.write(position, first)
+        assert len(first.chunks) > 1
+        assert len(_signed_passes()) == 1
+
+        second = _Chunks()
+        output.write(position, second)
+        assert second.chunks == [b"".join(first.chunks)]
@@ -0,0 +1,48 @@
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django_scopes import scopes_disabled
+from io import BytesIO
+from PIL import Image
+
+from pretix_passbook.assets import Asset, derived_asset_name, get_storage_asset
+from pretix_passbook.forms import PNGImageField
+
+
+@pytest.fixture
+def field():
+    return PNGImageField(display_size=(160, 50), derive_variants=True, required=False)
+
+
+def _upload():
+    buf = BytesIO()
+    Image.new("RGBA", (480, 150), (153, 0, 0, 255)).save(buf, "PNG")
+    return SimpleUploadedFile("logo.png", buf.getvalue(), "image/png")
+
+
+def _variants(value):
+    value.seek(0)
+    digest = Asset.from_bytes(value.read()).digest
+    return [derived_asset_name(digest, scale) for scale in (2, 3)]
+
+
+def test_clean_does_not_store_variants(field):
+    value = field.clean(_upload())
+    assert not any(default_storage.exists(name) for name in _variants(value))
+
+
+def test_variants_stored_with_settings(field, position):
+    value = field.clean(_upload())
+    logo = default_storage.save("passbook-test/logo.png", value)
+    variants = _variants(value)
+    # Workers might have looked for the variants before they existed
+    assert get_storage_asset(variants[0], "derived") is None
+    try:
+        with scopes_disabled():
+            position.order.event.settings.set("ticketoutput_passbook_logo", "file://" + logo)
+        assert all(default_storage.exists(name) for name in variants)
+        assert get_storage_asset(variants[0], "derived") is not None
+        assert Image.open(default_storage.open(variants[1])).size == (480, 150)
+    finally:
+        for name in [logo, *variants]:
+            default_storage.delete(name)
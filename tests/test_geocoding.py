@@ -0,0 +1,75 @@
+import io
+import json
+import pytest
+import zipfile
+from django.core.management import call_command
+from django_scopes import scopes_disabled
+
+from pretix_passbook.geocoding import StubGeocoder, get_geocoder, normalize_address
+from pretix_passbook.models import GeocodedAddress
+from pretix_passbook.passbook import PassbookOutput
+
+
+@pytest.fixture
+def geocoder(monkeypatch):
+    monkeypatch.setenv("PRETIX_PASSBOOK_GEOCODER", "pretix_passbook.geocoding.StubGeocoder")
+    get_geocoder.cache_clear()
+    monkeypatch.setattr(StubGeocoder, "results", {normalize_address("Main Street 1\nBerlin"): (52.5, 13.4)})
+    yield get_geocoder()
+    get_geocoder.cache_clear()
+
+
+@pytest.fixture
+def event(position):
+    event = position.order.event
+    with scopes_disabled():
+        event.geo_lat = event.geo_lon = None
+        event.location = "Main Street 1, Berlin"
+        event.save()
+        event.refresh_from_db()
+    return event
+
+
+def _locations(event, position):
+    with scopes_disabled():
+        data = PassbookOutput(event).generate(position)[2]
+    return json.loads(zipfile.ZipFile(io.BytesIO(data)).read("pass.json")).get("locations")
+
+
+def test_normalize_address():
+    assert normalize_address("  Main   Street 1,\n\n BERLIN ") == "main street 1, berlin"
+
+
+def test_location_from_stub(geocoder, event, position):
+    assert isinstance(geocoder, StubGeocoder)
+    # Passes never look addresses up themselves
+    assert _locations(event, position) is None
+
+    call_command("geocode_passbook", event.organizer.slug, event.slug)
+    location = _locations(event, position)[0]
+    assert (location["latitude"], location["longitude"]) == (52.5, 13.4)
+
+
+def test_unknown_address_stored(geocoder, event, position, monkeypatch):
+    calls = []
+    lookup = StubGeocoder.geocode
+    monkeypatch.setattr(StubGeocoder, "geocode", lambda self, address: calls.append(address) or lookup(self, address))
+    with scopes_disabled():
+        event.location = "Nowhere"
+        event.save()
+        event.refresh_from_db()
+
+    call_command("geocode_passbook", event.organizer.slug, event.slug)
+    call_command("geocode_passbook", event.organizer.slug, event.slug)
+    assert calls == ["nowhere"]
+    assert GeocodedAddress.objects.get(address="nowhere").latitude is None
+    assert _locations(event, position) is None
+
+
+def test_coordinates_entered_by_hand(geocoder, event, position):
+    call_command("geocode_passbook", event.organizer.slug, event.slug)
+    with scopes_disabled():
+        event.geo_lat, event.geo_lon = 49.4, 8.7
+        event.save()
+    location = _locations(event, position)[0]
+    assert (location["latitude"], location["longitude"]) == (49.4, 8.7)
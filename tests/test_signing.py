@@ -0,0 +1,41 @@
+import pytest
+import shutil
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from pretix_passbook import signing
+from pretix_passbook.signing import NativeSigner, OpenSSLSigner, get_signing_material
+
+requires_openssl = pytest.mark.skipif(not shutil.which("openssl"), reason="openssl binary not available")
+MANIFEST = b'{"pass.json": "0000000000000000000000000000000000000000"}'
+
+
+@pytest.fixture
+def material(position):
+    return get_signing_material(position.order.event.settings)
+
+
+@requires_openssl
+def test_signatures_identical_without_attributes(material, monkeypatch):
+    monkeypatch.setattr(signing, "REPRODUCIBLE", True)
+    assert NativeSigner().sign(MANIFEST, material) == OpenSSLSigner().sign(MANIFEST, material)
+
+
+@requires_openssl
+def test_signatures_contain_certificate(material):
+    for signer in (NativeSigner(), OpenSSLSigner()):
+        signature = signer.sign(MANIFEST, material)
+        assert material.certificate.public_bytes(serialization.Encoding.DER) in signature
+
+
+@requires_openssl
+def test_der_to_pem_identical(material):
+    der = material.certificate.public_bytes(serialization.Encoding.DER)
+    native = NativeSigner().der_to_pem(der)
+    assert native == OpenSSLSigner().der_to_pem(der)
+    assert x509.load_pem_x509_certificate(native) == material.certificate
+
+
+def test_der_to_pem_invalid():
+    with pytest.raises(ValueError):
+        NativeSigner().der_to_pem(b"no certificate")
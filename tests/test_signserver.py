@@ -0,0 +1,143 @@
+import os
+import pytest
+import stat
+import threading
+import time
+
+from pretix_passbook import signing
+from pretix_passbook.signing import NativeSigner, get_signing_material
+from pretix_passbook.signserver import (
+    PoolSigner, RemoteSigner, SigningServer, handle_request,
+)
+
+MANIFEST = b'{"pass.json": "0000000000000000000000000000000000000000"}'
+
+
+class FakeProcess:
+    killed = False
+
+    def kill(self):
+        self.killed = True
+
+
+class FakeConnection:
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def send(self, request):
+        self.requests.append(request)
+
+    def poll(self, timeout):
+        return self.respond is not None
+
+    def recv(self):
+        return self.respond(self.requests[-1])
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def material(position):
+    return get_signing_material(position.order.event.settings)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    signer = PoolSigner(processes=1, batch_size=8, timeout=1)
+    spawned = []
+
+    def spawn(respond):
+        def _spawn():
+            spawned.append((FakeConnection(respond), FakeProcess()))
+            return spawned[-1]
+        monkeypatch.setattr(signer, "_spawn", _spawn)
+
+    signer.spawn = spawn
+    signer.spawned = spawned
+    return signer
+
+
+def _sign(request):
+    return {"signatures": [b"signature"] * len(request["manifests"])}
+
+
+def test_pool_replaces_failed_process(pool, material):
+    pool.spawn(lambda request: {})
+    with pytest.raises(KeyError):
+        pool.sign_many([MANIFEST, MANIFEST], material)
+
+    pool.spawn(_sign)
+    assert pool.sign_many([MANIFEST, MANIFEST], material) == [b"signature", b"signature"]
+    assert len(pool.spawned) == 2
+    assert pool.spawned[0][1].killed
+    assert "key_pem" in pool.spawned[1][0].requests[0]
+
+
+def test_pool_rejects_missing_signatures(pool, material):
+    pool.spawn(lambda request: {"signatures": []})
+    with pytest.raises(ValueError):
+        pool.sign_many([MANIFEST], material)
+    assert pool.spawned[0][1].killed
+
+
+def test_pool_times_out(pool, material):
+    pool.spawn(None)
+    with pytest.raises(TimeoutError):
+        pool.sign_many([MANIFEST], material)
+    assert pool.spawned[0][1].killed
+
+
+def test_pool_keeps_process_on_signing_error(pool, material):
+    pool.spawn(lambda request: {"error": "invalid key"})
+    with pytest.raises(ValueError):
+        pool.sign_many([MANIFEST], material)
+    assert not pool.spawned[0][1].killed
+
+
+def test_server_socket_private(tmp_path, material, monkeypatch):
+    monkeypatch.setattr(signing, "REPRODUCIBLE", True)
+    path = str(tmp_path / "signer.sock")
+    server = SigningServer("unix:" + path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        signature = RemoteSigner("unix:" + path, connections=1, timeout=5).sign(MANIFEST, material)
+        assert signature == NativeSigner().sign(MANIFEST, material)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_pool_drops_jobs_no_longer_waited_for(pool, material):
+    release = threading.Event()
+
+    def respond(request):
+        release.wait(5)
+        return _sign(request)
+
+    pool.spawn(respond)
+    pool.timeout = 0.2
+    blocked = threading.Thread(target=lambda: pytest.raises(TimeoutError, pool.sign_many, [b"first"], material))
+    blocked.start()
+    while not (pool.spawned and pool.spawned[0][0].requests):
+        time.sleep(0.01)
+    with pytest.raises(TimeoutError):
+        pool.sign_many([b"second"], material)
+    release.set()
+    blocked.join()
+
+    pool.timeout = 5
+    assert pool.sign_many([b"third"], material) == [b"signature"]
+    assert [r["manifests"] for r in pool.spawned[0][0].requests] == [[b"first"], [b"third"]]
+
+
+def test_server_checks_material_digest(material):
+    request = {"material": "0" * 64, "manifests": [MANIFEST], **material.export()}
+    assert "error" in handle_request(request)
+    assert handle_request({"material": "0" * 64, "manifests": [MANIFEST]}) == {"missing": True}
+
+    request["material"] = material.digest
+    assert len(handle_request(request)["signatures"]) == 1
+    assert len(handle_request({"material": material.digest, "manifests": [MANIFEST]})["signatures"]) == 1
@@ -0,0 +1,22 @@
+from django_scopes import scopes_disabled
+from pretix.base.models import CachedTicket
+from pretix.base.services.tickets import get_tickets_for_order
+
+from pretix_passbook.tasks import pregenerate_passes
+
+
+def test_pregenerated_passes_attached(position):
+    order, event = position.order, position.order.event
+    event.settings.ticket_download = True
+    event.settings.ticketoutput_passbook__enabled = True
+    event.settings.ticketoutput_passbook_pregenerate = True
+    with scopes_disabled():
+        placeholder = CachedTicket.objects.create(
+            order_position=position, provider="passbook", extension=".pkpass", type="", file=None
+        )
+        pregenerate_passes.apply(kwargs={"event": event.pk, "order": order.pk})
+        ct = CachedTicket.objects.exclude(file="").get(order_position=position)
+        assert CachedTicket.objects.filter(pk=placeholder.pk).exists()
+
+        tickets = get_tickets_for_order(order)
+    assert [c.pk for name, c in tickets] == [ct.pk]
@@ -0,0 +1,68 @@
+import pytest
+from datetime import timedelta
+from django.test import override_settings
+from django_scopes import scopes_disabled
+
+from pretix_passbook import template
+from pretix_passbook.template import get_template, invalidate_templates
+
+
+@pytest.fixture
+def event(position):
+    return position.order.event
+
+
+def test_reused_without_shared_cache(event, settings):
+    settings.REAL_CACHE_USED = False
+    first = get_template(event)
+    assert get_template(event) is first
+    assert len(template._templates) == 1
+
+
+def test_invalidated_without_shared_cache(event, settings):
+    settings.REAL_CACHE_USED = False
+    first = get_template(event)
+    with scopes_disabled():
+        event.settings.ticketoutput_passbook_bg_color = "#000000"
+    second = get_template(event)
+    assert second is not first
+    assert second.background_color == "#000000"
+    assert get_template(event) is second
+
+
+def test_expires_without_shared_cache(event, settings, monkeypatch):
+    settings.REAL_CACHE_USED = False
+    first = get_template(event)
+    monkeypatch.setattr(template, "LOCAL_TEMPLATE_TIMEOUT", 1e-9)
+    assert get_template(event) is not first
+
+
+@override_settings(
+    REAL_CACHE_USED=True,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+def test_reused_with_shared_cache(event):
+    first = get_template(event)
+    assert get_template(event) is first
+    invalidate_templates(event_id=event.pk)
+    assert get_template(event) is not first
+
+
+@override_settings(
+    REAL_CACHE_USED=True,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+def test_date_rebuilt_after_bulk_edit(fixtures):
+    position = fixtures.event("series")
+    event, subevent = position.order.event, position.subevent
+    first = get_template(event, subevent)
+    assert get_template(event, subevent) is first
+
+    with scopes_disabled():
+        subevent.name = "Renamed"
+        subevent.date_admission = subevent.date_from - timedelta(hours=1)
+        type(subevent).objects.bulk_update([subevent], ["name", "date_admission"])
+        subevent = type(subevent).objects.get(pk=subevent.pk)
+    second = get_template(event, subevent)
+    assert second.event_name == "Renamed"
+    assert second.admission and not first.admission
@@ -0,0 +1,181 @@
+import io
+import json
+import pytest
+import time
+import zipfile
+from datetime import timedelta
+from django.test import TestCase
+from django_scopes import scopes_disabled
+from pretix.base.models import LogEntry, OrderPosition, SubEvent
+from pretix.base.signals import order_modified
+
+from pretix_passbook.models import IssuedPass, Registration
+from pretix_passbook.passbook import PassbookOutput
+from pretix_passbook.push import LocalPushSender
+from pretix_passbook.signals import dates_changed
+from pretix_passbook.webservice import (
+    authentication_token, mark_dependent_passes, serial_number,
+)
+
+
+@pytest.fixture
+def event(position, monkeypatch, settings):
+    # Wallet only talks to web services over HTTPS
+    settings.SITE_URL = "https://example.com"
+    monkeypatch.setattr("pretix_passbook.tasks.get_push_sender", LocalPushSender)
+    LocalPushSender.sent.clear()
+    event = position.order.event
+    event.settings.ticketoutput_passbook_webservice = True
+    return event
+
+
+@pytest.fixture
+def serial(position):
+    with scopes_disabled():
+        return serial_number(position)
+
+
+@pytest.fixture
+def base(event):
+    return "/{}/{}/passbook/webservice/v1/".format(event.organizer.slug, event.slug)
+
+
+@pytest.fixture
+def auth(serial):
+    return {"HTTP_AUTHORIZATION": "ApplePass " + authentication_token(serial)}
+
+
+def _register(client, base, serial, auth, pass_type="pass.benchmark", device="device"):
+    return client.post(
+        "{}devices/{}/registrations/{}/{}".format(base, device, pass_type, serial),
+        json.dumps({"pushToken": "token"}),
+        content_type="application/json",
+        **auth,
+    )
+
+
+def test_register(client, base, serial, auth):
+    assert _register(client, base, serial, {}).status_code == 401
+    assert _register(client, base, serial, auth, pass_type="pass.other").status_code == 404
+    assert _register(client, base, serial, auth).status_code == 201
+    assert _register(client, base, serial, auth).status_code == 200
+
+    r = client.get(base + "devices/device/registrations/pass.benchmark")
+    assert r.status_code == 200
+    assert r.json()["serialNumbers"] == [serial]
+    r = client.get(base + "devices/device/registrations/pass.benchmark?passesUpdatedSince=" + r.json()["lastUpdated"])
+    assert r.status_code == 204
+
+    r = client.delete(base + "devices/device/registrations/pass.benchmark/" + serial, **auth)
+    assert r.status_code == 200
+    with scopes_disabled():
+        assert not Registration.objects.exists()
+
+
+def test_latest_pass(client, event, base, serial, auth, monkeypatch):
+    _register(client, base, serial, auth)
+    assert client.get(base + "passes/pass.benchmark/" + serial).status_code == 401
+
+    r = client.get(base + "passes/pass.benchmark/" + serial, **auth)
+    assert r.status_code == 200
+    pass_json = json.loads(zipfile.ZipFile(io.BytesIO(r.content)).read("pass.json"))
+    assert pass_json["serialNumber"] == serial
+    assert pass_json["webServiceURL"].startswith("https://example.com/")
+    assert pass_json["authenticationToken"] == auth["HTTP_AUTHORIZATION"][len("ApplePass "):]
+
+    r2 = client.get(base + "passes/pass.benchmark/" + serial, HTTP_IF_NONE_MATCH=r["ETag"], **auth)
+    assert r2.status_code == 304
+
+    # Unchanged passes are answered without building them
+    with monkeypatch.context() as m:
+        m.setattr("pretix_passbook.passbook.PassbookOutput.prepare", None)
+        r2 = client.get(base + "passes/pass.benchmark/" + serial, HTTP_IF_MODIFIED_SINCE=r["Last-Modified"], **auth)
+        assert r2.status_code == 304
+        r2 = client.get(base + "passes/pass.benchmark/" + serial, HTTP_IF_NONE_MATCH=r["ETag"], **auth)
+        assert r2.status_code == 304
+        assert r2["ETag"] == r["ETag"]
+
+    # Passes marked as updated are built again
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        mark_dependent_passes(event_id=event.pk)
+    prepare = PassbookOutput.prepare
+    monkeypatch.setattr(PassbookOutput, "prepare", lambda self, op: prepared.append(op) or prepare(self, op))
+    prepared = []
+    r2 = client.get(base + "passes/pass.benchmark/" + serial, HTTP_IF_NONE_MATCH=r["ETag"], **auth)
+    assert r2.status_code == 304
+    assert len(prepared) == 1
+
+
+def test_push_on_order_change(client, event, position, base, serial, auth):
+    _register(client, base, serial, auth)
+    r = client.get(base + "passes/pass.benchmark/" + serial, **auth)
+    tag = client.get(base + "devices/device/registrations/pass.benchmark").json()["lastUpdated"]
+    # Modification times are compared in seconds
+    time.sleep(1)
+
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        order_modified.send(event, order=position.order)
+    assert LocalPushSender.sent == [(event.pk, "token")]
+
+    r2 = client.get(base + "devices/device/registrations/pass.benchmark?passesUpdatedSince=" + tag)
+    assert r2.json()["serialNumbers"] == [serial]
+    r2 = client.get(base + "passes/pass.benchmark/" + serial, HTTP_IF_MODIFIED_SINCE=r["Last-Modified"], **auth)
+    assert r2.status_code == 200
+
+
+def test_log(client, base):
+    r = client.post(base + "log", json.dumps({"logs": ["Something went wrong"]}), content_type="application/json")
+    assert r.status_code == 200
+    assert client.post(base + "log", "no json", content_type="application/json").status_code == 400
+
+
+@pytest.mark.parametrize("position", ["series"], indirect=True)
+def test_push_on_bulk_edit(client, event, position, base, serial, auth):
+    _register(client, base, serial, auth)
+    client.get(base + "passes/pass.benchmark/" + serial, **auth)
+    tag = client.get(base + "devices/device/registrations/pass.benchmark").json()["lastUpdated"]
+    time.sleep(1)
+
+    # Dates changed in bulk are saved and logged without sending signals
+    subevent = position.subevent
+    subevent.date_admission = subevent.date_from - timedelta(hours=1)
+    with scopes_disabled():
+        SubEvent.objects.bulk_update([subevent], ["date_admission"])
+        LogEntry.bulk_create_and_postprocess([subevent.log_action("pretix.subevent.changed", save=False)])
+    assert LocalPushSender.sent == []
+
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        dates_changed(None)
+    assert LocalPushSender.sent == [(event.pk, "token")]
+    r = client.get(base + "devices/device/registrations/pass.benchmark?passesUpdatedSince=" + tag)
+    assert r.json()["serialNumbers"] == [serial]
+
+    # Passes are only marked once for every change
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        dates_changed(None)
+    assert LocalPushSender.sent == [(event.pk, "token")]
+
+
+def test_marks_applied_once(client, event, base, serial, auth):
+    _register(client, base, serial, auth)
+    client.get(base + "passes/pass.benchmark/" + serial, **auth)
+
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        mark_dependent_passes(event_id=event.pk)
+        mark_dependent_passes(event_id=event.pk)
+    assert LocalPushSender.sent == [(event.pk, "token")]
+
+
+@pytest.mark.parametrize("position", ["seated"], indirect=True)
+def test_push_on_seat_deletion(client, event, position, base, serial, auth):
+    _register(client, base, serial, auth)
+    client.get(base + "passes/pass.benchmark/" + serial, **auth)
+
+    with scopes_disabled():
+        seat = position.seat
+        # Seats of positions cannot be deleted, but passes keep the seat they were issued with
+        OrderPosition.all.filter(pk=position.pk).update(seat=None)
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            seat.delete()
+        assert IssuedPass.objects.get().seat_id is None
+    assert LocalPushSender.sent == [(event.pk, "token")]